@@ -0,0 +1,67 @@
+# ===============================================================
+# 	Info	:	synthetic kinematics file in the JIGSAWS format
+# ===============================================================
+
+# ======================
+#   required libraries
+# ======================
+import argparse
+import numpy as np
+
+
+# =============
+#   functions
+# =============
+def rpy_rotations(rpy):
+    """
+    @info: rotation matrices (rows of 9 values) of rpy angles [N x 3]
+    """
+    cr, cp, cy = np.cos(rpy).T
+    sr, sp, sy = np.sin(rpy).T
+    return np.stack((cy*cp, cy*sp*sr - sy*cr, cy*sp*cr + sy*sr,
+                     sy*cp, sy*sp*sr + cy*cr, sy*sp*cr - cy*sr,
+                     -sp,   cp*sr,            cp*cr), axis=1)
+
+def generate_jigsaws(path, n_rows=5000, dt=0.01, seed=0):
+    """
+    @info: writes a kinematics file with the layout of JIGSAWS (76 columns separated by spaces).
+           Each of the 4 arms (master left/right, slave left/right) has 19 columns: position (3),
+           rotation matrix (9), linear velocity (3), angular velocity (3) and gripper angle (1).
+           The motion is smooth and the orientation wraps around +-pi.
+
+    @inputs:
+    -------
+        - path: path of the file
+        - n_rows: number of samples
+        - dt: sampling time [sec]
+        - seed: seed of the random motion
+    """
+    rng = np.random.default_rng(seed)
+    t = dt*np.arange(n_rows)[:, None]
+    data = np.empty((n_rows, 76))
+    for arm in range(4):
+        c = 19*arm
+        freq = rng.uniform(0.1, 0.5, size=(1, 3))
+        phase = rng.uniform(0, 2*np.pi, size=(1, 3))
+        w = 2*np.pi*freq
+        # position and linear velocity
+        data[:, c:c+3] = np.array([0.0, 0.5, 0.1]) + 0.05*np.sin(w*t + phase)
+        data[:, c+12:c+15] = 0.05*w*np.cos(w*t + phase)
+        # orientation (the yaw angle turns) and angular velocity
+        rpy = 0.3*np.sin(w*t + phase)
+        rpy[:, 2] += 0.5*t[:, 0]
+        data[:, c+3:c+12] = rpy_rotations(rpy)
+        data[:, c+15:c+18] = np.gradient(rpy, dt, axis=0)
+        # gripper angle
+        data[:, c+18] = 0.2*np.sin(w[0, 0]*t[:, 0])
+    np.savetxt(path, data, fmt='%.6f')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='synthetic JIGSAWS kinematics file')
+    parser.add_argument('path')
+    parser.add_argument('--rows', type=int, default=5000)
+    parser.add_argument('--dt', type=float, default=0.01)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    generate_jigsaws(args.path, args.rows, args.dt, args.seed)
@@ -0,0 +1,242 @@
+# ===============================================================
+# 	Info	:	benchmarks of the hot paths of labpythonlib
+# ===============================================================
+"""
+Runs offline (bundled 6-dof urdf and synthetic JIGSAWS file) and writes the results to a json
+file that can be compared with the results of another version:
+
+    $ python3 benchmarks/run_benchmarks.py --output new.json
+    $ python3 benchmarks/run_benchmarks.py --output new.json --compare old.json
+
+The library is imported from the installed version (or PYTHONPATH) and otherwise from this
+repository. Only the methods that all the versions have are required; the benchmarks of methods that are
+missing in the installed version are skipped.
+"""
+
+# ======================
+#   required libraries
+# ======================
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import numpy as np
+try:
+    # installed version (or PYTHONPATH)
+    import labpythonlib.lab_functions as lf
+except ImportError:
+    # version of this repository
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    import labpythonlib.lab_functions as lf
+from jigsaws_generator import generate_jigsaws
+
+URDF_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_arm.urdf')
+Q_HOME = np.array([0.0, -0.8, 1.2, -0.4, 0.5, 0.3])
+
+
+# =============
+#   functions
+# =============
+def measure(name, fn, n_calls, items=1, unit='calls', warmup=10):
+    """
+    @info: calls fn() n_calls times and measures the latency of each call
+
+    @inputs:
+    -------
+        - name: name of the benchmark
+        - fn: function without arguments
+        - n_calls: number of measured calls
+        - items: items processed by each call (steps, solves, rows, ...)
+        - unit: name of the items
+        - warmup: calls before the measure
+    @outputs:
+    --------
+        - result: throughput [items/s] and latency percentiles [us] of a call
+    """
+    for _ in range(warmup):
+        fn()
+    latency = np.empty(n_calls)
+    clock = time.perf_counter
+    t_start = clock()
+    for i in range(n_calls):
+        t0 = clock()
+        fn()
+        latency[i] = clock() - t0
+    total = clock() - t_start
+    latency *= 1e6
+    result = {'name': name, 'unit': unit, 'calls': n_calls, 'items_per_call': items,
+              'throughput': n_calls*items/total, 'total_s': total,
+              'mean_us': float(np.mean(latency)), 'p50_us': float(np.percentile(latency, 50)),
+              'p90_us': float(np.percentile(latency, 90)), 'p99_us': float(np.percentile(latency, 99)),
+              'max_us': float(np.max(latency))}
+    print("{:<40s} {:>12.1f} {:<8s} p50 {:>10.1f} us  p99 {:>10.1f} us".format(
+          name, result['throughput'], unit + '/s', result['p50_us'], result['p99_us']))
+    return result
+
+def random_targets(robot, n, seed=0):
+    """
+    @info: reachable poses (forward kinematics of random configurations) and IK seeds near them
+    """
+    rng = np.random.default_rng(seed)
+    q = Q_HOME + rng.uniform(-1.0, 1.0, size=(n, robot.ndof))
+    targets = [robot.forward_kinematics(qi) for qi in q]
+    seeds = q + 0.1*rng.standard_normal(q.shape)
+    return targets, seeds
+
+def bench_robot(scale):
+    results = []
+    robot = lf.Robot(Q_HOME.copy(), np.zeros(6), 0.001, URDF_PATH)
+    tau = np.array(robot.get_g())
+    results.append(measure('robot.send_control_command', lambda: robot.send_control_command(tau),
+                           2000*scale, unit='steps'))
+
+    def step_and_read():
+        robot.send_control_command(tau)
+        robot.read_joint_position_velocity_acceleration()
+        robot.read_cartesian_position_velocity_acceleration()
+        robot.read_ee_orientation()
+        robot.read_ee_angular_velocity_acceleration()
+    results.append(measure('robot.step_and_read_state', step_and_read, 1000*scale, unit='steps'))
+
+    def step_with_dynamics():
+        robot.send_control_command(tau)
+        robot.get_M(), robot.get_b(), robot.get_g()
+    results.append(measure('robot.step_and_dynamics', step_with_dynamics, 1000*scale, unit='steps'))
+
+    if hasattr(robot, 'rollout'):
+        controller = lambda t, r: tau
+        results.append(measure('robot.rollout(1000 steps)', lambda: robot.rollout(controller, 1.0),
+                               5*scale, items=1000, unit='steps', warmup=1))
+    return results
+
+def bench_ik(scale):
+    results = []
+    robot = lf.Robot(Q_HOME.copy(), np.zeros(6), 0.001, URDF_PATH)
+    n = 200*scale
+    targets, seeds = random_targets(robot, n)
+    it = iter(range(10**9))
+
+    def ik_position():
+        i = next(it) % n
+        robot.inverse_kinematics_position(targets[i][0], seeds[i])
+    results.append(measure('robot.inverse_kinematics_position', ik_position, n, unit='solves'))
+
+    def ik_pose():
+        i = next(it) % n
+        robot.inverse_kinematics_pose(targets[i][0], targets[i][1], seeds[i])
+    results.append(measure('robot.inverse_kinematics_pose', ik_pose, n, unit='solves'))
+
+    if hasattr(robot, 'inverse_kinematics_batch'):
+        x_des = np.array([x for x, _ in targets])
+        R_des = np.array([R for _, R in targets])
+        results.append(measure('robot.inverse_kinematics_batch(pose)',
+                               lambda: robot.inverse_kinematics_batch(x_des, seeds, R_des),
+                               3, items=n, unit='solves', warmup=1))
+    return results
+
+def bench_kalman(scale):
+    n_dof = 6
+    rng = np.random.default_rng(0)
+    kf = lf.MultipleKalmanDerivator(0.001, np.zeros(n_dof), np.zeros(n_dof), np.zeros(n_dof))
+    z = rng.standard_normal((1000, 2, n_dof))
+    it = iter(range(10**9))
+
+    def update():
+        i = next(it) % 1000
+        kf.update(z[i, 0], z[i, 1])
+    return [measure('multiple_kalman_derivator.update', update, 5000*scale, unit='updates')]
+
+def bench_dataset(scale, folder):
+    results = []
+    n_rows = 5000*scale
+    path = os.path.join(folder, 'jigsaws_{}.txt'.format(n_rows))
+    generate_jigsaws(path, n_rows)
+    reader = lf.DataReader(path)
+    results.append(measure('data_reader.read_dataset', lambda: reader.read_dataset(),
+                           3, items=n_rows, unit='rows', warmup=1))
+
+    def read_and_calculate():
+        reader.read_dataset()
+        reader.calculate()
+    results.append(measure('data_reader.read_dataset+calculate', read_and_calculate,
+                           3, items=n_rows, unit='rows', warmup=1))
+    return results
+
+def bench_rotations(scale):
+    results = []
+    rng = np.random.default_rng(0)
+    rpy = rng.uniform(-np.pi/2 + 0.1, np.pi/2 - 0.1, size=(1000, 3))
+    R = np.array([lf.rpy2rot(a) for a in rpy])
+    Q = np.array([lf.rot2quat(Ri) for Ri in R])
+    it = iter(range(10**9))
+    single = [('rpy2rot', lambda i: lf.rpy2rot(rpy[i])),
+              ('rot2rpy', lambda i: lf.rot2rpy(R[i])),
+              ('rot2quat', lambda i: lf.rot2quat(R[i])),
+              ('rot2axisangle', lambda i: lf.rot2axisangle(R[i])),
+              ('quatError', lambda i: lf.quatError(Q[i], Q[i-1])),
+              ('axisangle_error', lambda i: lf.axisangle_error(R[i], R[i-1])),
+              ('rot2rpy_unwrapping', lambda i: lf.rot2rpy_unwrapping(R[i], rpy[i-1])),
+              ('rpy2angularVel', lambda i: lf.rpy2angularVel(rpy[i], rpy[i-1])),
+              ('angularVel2rpy', lambda i: lf.angularVel2rpy(rpy[i-1], rpy[i])),
+              ('rpy2angularAccel', lambda i: lf.rpy2angularAccel(rpy[i], rpy[i-1], rpy[i-2]))]
+    for name, fn in single:
+        results.append(measure(name, lambda: fn(next(it) % 1000), 5000*scale, unit='calls'))
+    batch = [('rpy2rot_batch', lambda: lf.rpy2rot_batch(rpy)),
+             ('rot2rpy_batch', lambda: lf.rot2rpy_batch(R)),
+             ('rot2quat_batch', lambda: lf.rot2quat_batch(R)),
+             ('axisangle_error_batch', lambda: lf.axisangle_error_batch(R[1:], R[:-1])),
+             ('rot2rpy_unwrapping_batch', lambda: lf.rot2rpy_unwrapping_batch(R, np.zeros(3))),
+             ('rpy_rates_batch', lambda: lf.rpy_rates_batch(rpy, rpy[::-1], rpy, rpy[::-1]))]
+    for name, fn in batch:
+        if hasattr(lf, name):
+            results.append(measure(name, fn, 50*scale, items=len(R), unit='rows'))
+    return results
+
+def compare(results, baseline_path):
+    """
+    @info: prints the speedup of each benchmark w.r.t. a previous result file
+    """
+    with open(baseline_path) as f:
+        baseline = {r['name']: r for r in json.load(f)['results']}
+    print("\n{:<40s} {:>10s} {:>10s}".format('benchmark', 'speedup', 'p99 ratio'))
+    for r in results:
+        old = baseline.get(r['name'])
+        if old is None:
+            continue
+        print("{:<40s} {:>9.2f}x {:>10.2f}".format(r['name'], r['throughput']/old['throughput'],
+                                                  r['p99_us']/old['p99_us']))
+
+def main():
+    groups = {'robot': bench_robot, 'ik': bench_ik, 'kalman': bench_kalman,
+              'dataset': bench_dataset, 'rotations': bench_rotations}
+    parser = argparse.ArgumentParser(description='benchmarks of labpythonlib')
+    parser.add_argument('--output', default='bench_results.json', help='json file of the results')
+    parser.add_argument('--compare', default=None, help='json file of a previous run')
+    parser.add_argument('--groups', nargs='+', default=list(groups), choices=list(groups))
+    parser.add_argument('--scale', type=int, default=1, help='multiplies the number of calls')
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as folder:
+        for name in args.groups:
+            if name == 'dataset':
+                results += bench_dataset(args.scale, folder)
+            else:
+                results += groups[name](args.scale)
+
+    info = {'python': platform.python_version(), 'numpy': np.__version__,
+            'pinocchio': lf.pin.__version__, 'platform': platform.platform(),
+            'processor': platform.processor(), 'cpu_count': os.cpu_count(),
+            'date': time.strftime('%Y-%m-%d %H:%M:%S')}
+    with open(args.output, 'w') as f:
+        json.dump({'info': info, 'results': results}, f, indent=2)
+    print("results written to", args.output)
+    if args.compare is not None:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+# ===============================================================
+# 	Info	:	counters of measures (durations, sizes, ...)
+# ===============================================================
+"""
+Counter used by lab_profiler, lab_scheduler and lab_pipeline. It only depends on numpy, so 
+the loop timers do not import pinocchio.
+"""
+
+# ======================
+#   required libraries
+# ======================
+import threading
+import numpy as np
+
+
+class Counter(object):
+    """
+    @info: number of calls, total and last samples (for the percentiles) of a measure.
+           It can be updated from several threads (e.g. the wrapped pinocchio calls).
+
+    @inputs:
+    -------
+        - unit: unit of the samples ('s' for durations)
+        - n_samples: number of last samples kept for the percentiles
+    """
+    def __init__(self, unit='s', n_samples=10000):
+        self.unit = unit
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples = np.zeros(n_samples)
+        self.lock = threading.Lock()
+
+    def add(self, value):
+        with self.lock:
+            self.samples[self.calls % self.samples.shape[0]] = value
+            self.calls += 1
+            self.total += value
+            if value > self.max:
+                self.max = value
+
+    def summary(self):
+        """
+        @info: calls, total, mean, percentiles (50, 90, 99) and maximum of the samples
+        """
+        with self.lock:
+            calls, total, max_ = self.calls, self.total, self.max
+            s = self.samples[:min(calls, self.samples.shape[0])].copy()
+        p50, p90, p99 = np.percentile(s, [50, 90, 99]) if s.shape[0] > 0 else (0.0, 0.0, 0.0)
+        return {'unit': self.unit, 'calls': calls, 'total': total,
+                'mean': total/calls if calls else 0.0,
+                'p50': float(p50), 'p90': float(p90), 'p99': float(p99), 'max': max_}
@@ -8,6 +8,9 @@
 #   required libraries
 # ======================
 import os
+import glob
+import math
+import hashlib
 import numpy as np
 import pinocchio as pin
 from copy import copy
@@ -16,6 +19,23 @@ from numpy import multiply as mul
 from numpy import matmul as mx
 from numpy import transpose as tr
 import pandas as pd
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    # nearest neighbor queries by brute force
+    cKDTree = None
+try:
+    from scipy.linalg.lapack import dpotrf, dpotrs
+except ImportError:
+    # cholesky by numpy.linalg.solve
+    dpotrf = dpotrs = None
+try:
+    from scipy.signal import lfilter
+except ImportError:
+    # reference_trajectory_batch by a step-wise loop
+    lfilter = None
 
 
 # =============
@@ -105,7 +125,125 @@ def circular_trayectory_generator(t,radius=0.05, z_amp=0.02, rpy_amp=np.zeros(3)
     # return end-effector pose and its time-derivative
     return np.concatenate((pos, rpy), axis=0), np.concatenate((vel, drpy), axis=0)
 
-def reference_trajectory(x_des, dx_des, x_ref0, dx_ref0, dt):
+def time_horizon(t_stop, dt, t_start=0.0):
+    """
+    @info: time vector of a horizon, from t_start to t_stop (not included) every dt seconds
+
+    @inputs:
+    -------
+        - t_stop: final time [sec]
+        - dt: sampling time [sec]
+        - t_start: initial time [sec]
+    @outputs:
+    --------
+        - t: time vector [T]
+    """
+    n = int(np.ceil((t_stop - t_start)/dt - 1e-9))
+    return t_start + dt*np.arange(max(n, 0))
+
+def sinusoidal_reference_horizon(q0, a, f, t_change, t):
+    """
+    @info: sinusoidal_reference_generator evaluated over a whole time vector.
+
+    @inputs: 
+    ------
+        - q0: initial joint/cartesian position [dim]
+        - a: amplitude [dim]
+        - f: frecuency [hz]
+        - t_change: change from sinusoidal to constant reference [sec]
+        - t: time vector [T] (see time_horizon)
+    @outputs:
+    -------
+        - q, dq, ddq: joint/carteisan position, velocity and acceleration [T x dim]
+    """
+    w = 2*np.pi*f               # [rad/s]
+    t = np.asarray(t, dtype=float)
+    shape = t.shape + (1,)*np.ndim(np.broadcast(q0, a))
+    moving = (t <= t_change).reshape(shape)
+    sin_wt = np.sin(w*np.minimum(t, t_change)).reshape(shape)
+    cos_wt = np.where(t <= t_change, np.cos(w*t), 0.0).reshape(shape)
+    q = q0 + a*sin_wt                   # [rad]
+    dq = a*w*cos_wt                     # [rad/s]
+    ddq = -a*w*w*sin_wt*moving          # [rad/s^2]
+    return q, dq, ddq
+
+def step_reference_horizon(q0, a, t_step, t):
+    """
+    @info: step_reference_generator evaluated over a whole time vector.
+
+    @inputs:
+    ------
+        - q0: initial joint/cartesian position [dim]
+        - a: constant reference [dim]
+        - t_step: start step [sec]
+        - t: time vector [T] (see time_horizon)
+    @outputs:
+    -------
+        - q, dq, ddq: joint/carteisan position, velocity and acceleration [T x dim]
+    """
+    t = np.asarray(t, dtype=float)
+    q0 = np.asarray(q0, dtype=float)
+    step = (t >= t_step).reshape(t.shape + (1,)*np.ndim(np.broadcast(q0, a)))
+    q = np.where(step, q0 + a, q0)  # [rad]
+    dq = np.zeros(q.shape)          # [rad/s]
+    ddq = np.zeros(q.shape)         # [rad/s^2]
+    return q, dq, ddq
+
+def circular_trayectory_horizon(t, radius=0.05, z_amp=0.02, rpy_amp=np.zeros(3), freq_xyz=0.1, freq_rpy=0.1):
+    """
+    @info circular_trayectory_generator evaluated over a whole time vector.
+
+    @inputs:
+    -------
+        - t : time vector [T] (see time_horizon)
+        - radius: radius of circular trajectory on xy-plane [m]
+        - z_amp: amplitude of sinusoidal trajectory on z-plane [m]
+        - rpy_amp: amplitude of sinusoidal trajectory of rpy angles [rad]
+        - freq_xyz, freq_rpy: frequency [hz]
+
+    Outpus:
+    -------
+        - pose: end-effector position (xyz) and orientation (rpy) [T x 6]
+        - dpose: end-effector velocity (xyz) and dorientation (rpy) [T x 6]
+    """
+    # Parameters of circular trayetory     
+    w_xyz = 2*np.pi*freq_xyz   # angular velocity [rad/s]
+    w_rpy = 2*np.pi*freq_rpy   # angular velocity [rad/s]
+    pos0 = np.array([0.5, 0.0, 0.0]) # initial states
+    rpy0 = rot2rpy(np.array([[1, 0, 0], [0, -1, 0], [0, 0, -1]]))
+    t = np.asarray(t, dtype=float)
+
+    pose = np.empty(t.shape + (6,))
+    dpose = np.empty(t.shape + (6,))
+    sin_xyz, cos_xyz = np.sin(w_xyz*t), np.cos(w_xyz*t)
+    # xyz position
+    pose[..., 0] = pos0[0] + radius*cos_xyz
+    pose[..., 1] = pos0[1] + radius*sin_xyz
+    pose[..., 2] = pos0[2] + z_amp*sin_xyz
+    # xyz velocity
+    dpose[..., 0] = radius*(-w_xyz)*sin_xyz
+    dpose[..., 1] = radius*(+w_xyz)*cos_xyz
+    dpose[..., 2] = z_amp*w_xyz*cos_xyz
+    # rpy orientation
+    pose[..., 3:6] = rpy0 + rpy_amp*np.sin(w_rpy*t)[..., None]
+    dpose[..., 3:6] = rpy_amp*w_rpy*np.cos(w_rpy*t)[..., None]
+    return pose, dpose
+
+def horizon_generator(*arrays):
+    """
+    @info: iterates over precomputed horizon arrays (e.g. q, dq, ddq), one sample per tick
+
+    @inputs:
+    -------
+        - arrays: arrays with the samples in the first axis [T x dim]
+    @outputs:
+    --------
+        - one tuple of rows (views, no copies) per sample
+    """
+    for i in range(len(arrays[0])):
+        yield tuple(array[i] for array in arrays)
+
+def reference_trajectory(x_des, dx_des, x_ref0, dx_ref0, dt, psi=1, wn=4):
     """
     Info: Generates a reference trajectory based on a desired trajectory.
 
@@ -114,10 +252,9 @@ def reference_trajectory(x_des, dx_des, x_ref0, dx_ref0, dt):
         - x_des:  desired trajectory
         - x_ref0: initial conditions of x_ref
         - dt:     sampling time 
+        - psi:    damping factor (optional)
+        - wn:     natural frecuency (optional)
     """
-    psi = 1 # damping factor
-    wn  = 4 # natural frecuency
-
     k0 = wn*wn
     k1 = 2*psi*wn
     # compute ddx_ref
@@ -128,6 +265,55 @@ def reference_trajectory(x_des, dx_des, x_ref0, dx_ref0, dt):
 
     return x_ref, dx_ref, ddx_ref
 
+def reference_trajectory_batch(x_des, dx_des, x_ref0, dx_ref0, dt, psi=1, wn=4):
+    """
+    Info: reference_trajectory applied over a whole desired trajectory. The recursion is run as
+          a linear filter along time (scipy.signal.lfilter) for all dimensions at once:
+              x_ref[k]  = a1*x_ref[k-1]  - a2*x_ref[k-2]  + dt^2*u[k]
+              dx_ref[k] = a1*dx_ref[k-1] - a2*dx_ref[k-2] + dt*(u[k] - u[k-1])
+          with u = k1*dx_des + k0*x_des, a1 = 2 - dt*k1 - dt^2*k0 and a2 = 1 - dt*k1.
+
+    Inputs: 
+    ------
+        - x_des, dx_des:  desired trajectory [N x dim]
+        - x_ref0, dx_ref0: initial conditions of x_ref and dx_ref [dim]
+        - dt:     sampling time 
+        - psi:    damping factor (optional)
+        - wn:     natural frecuency (optional)
+    Outputs:
+    -------
+        - x_ref, dx_ref, ddx_ref: reference trajectory [N x dim] (row k is the k-th step-wise call)
+    """
+    x_des = np.asarray(x_des, dtype=float)
+    dx_des = np.asarray(dx_des, dtype=float)
+    n = len(x_des)
+    x_ref = np.empty(np.broadcast(x_des, dx_des).shape)
+    dx_ref = np.empty(x_ref.shape)
+    if n == 0:
+        return x_ref, dx_ref, np.empty(x_ref.shape)
+    # first two steps as the step-wise version (initial conditions of the filters)
+    x_prev, dx_prev = x_ref0, dx_ref0
+    for k in range(min(n, 2) if lfilter is not None else n):
+        x_prev, dx_prev, _ = reference_trajectory(x_des[k], dx_des[k], x_prev, dx_prev, dt, psi, wn)
+        x_ref[k], dx_ref[k] = x_prev, dx_prev
+    if lfilter is not None and n > 2:
+        k0 = wn*wn
+        k1 = 2*psi*wn
+        u = (np.multiply(dx_des,k1) + np.multiply(x_des,k0)).reshape(n, -1)
+        a = [1.0, -(2 - dt*k1 - dt*dt*k0), 1 - dt*k1]
+        for y, b in ((x_ref.reshape(n, -1), [dt*dt, 0.0]), (dx_ref.reshape(n, -1), [dt, -dt])):
+            # filter state (transposed direct form II) after the first two steps
+            zi = np.stack((b[1]*u[1] - a[1]*y[1] - a[2]*y[0], -a[2]*y[1]), axis=0)
+            y[2:] = lfilter(b, a, u[2:], axis=0, zi=zi)[0]
+    # ddx_ref from the previous state (as the step-wise version)
+    ddx_ref = np.empty(x_ref.shape)
+    ddx_ref[0] = reference_trajectory(x_des[0], dx_des[0], x_ref0, dx_ref0, dt, psi, wn)[2]
+    if n > 1:
+        k0 = wn*wn
+        k1 = 2*psi*wn
+        ddx_ref[1:] = np.multiply(dx_des[1:],k1) + np.multiply(x_des[1:],k0) -  np.multiply(dx_ref[:-1],k1) - np.multiply(x_ref[:-1],k0)
+    return x_ref, dx_ref, ddx_ref
+
 def update_learning_rate(x, x_min=0.1, x_max=0.7, y_min=0.01, y_max=1):    
     """
     @info function to update learning rate
@@ -149,6 +335,35 @@ def tl(array):
     """
     return array.tolist()    
 
+def rot2axisangle_batch(R):
+    """
+    @info: computes axis/angle values from a stack of rotation matrices
+
+    @inputs:
+    --------
+        - R: rotation matrices [N x 3 x 3]
+    @outputs:
+    --------
+        - angle: angles of rotation [N]
+        - axis: axes of rotation [N x 3] (zeros if the angle is zero)
+    """
+    R = np.asarray(R, dtype=float)
+    R32 = R[...,2,1]
+    R23 = R[...,1,2]
+    R13 = R[...,0,2]
+    R31 = R[...,2,0]
+    R21 = R[...,1,0]
+    R12 = R[...,0,1]
+    tr  = R[...,0,0] + R[...,1,1] + R[...,2,2]
+    # angle
+    angle = np.arctan2(0.5*np.sqrt( np.power(R21-R12,2)+np.power(R31-R13,2)+np.power(R32-R23,2)), 0.5*(tr-1))
+    # axis
+    rotated = angle!=0
+    den = np.where(rotated, 2*np.sin(angle), 1.0)
+    axis = np.stack(((R32-R23)/den, (R13-R31)/den, (R21-R12)/den), axis=-1)
+    axis[~rotated] = 0.0
+    return angle, axis
+
 def rot2axisangle(R):
     """
     @info: computes axis/angle values from rotation matrix
@@ -161,21 +376,15 @@ def rot2axisangle(R):
         - angle: angle of rotation
         - axis: axis of rotation
     """
-    R32 = R[2,1]
-    R23 = R[1,2]
-    R13 = R[0,2]
-    R31 = R[2,0]
-    R21 = R[1,0]
-    R12 = R[0,1]
-    tr  = np.diag(R).sum()
+    # single matrix: python floats (the batch kernel is slower for one sample)
+    (R11, R12, R13), (R21, R22, R23), (R31, R32, R33) = np.asarray(R, dtype=float).tolist()
+    tr  = R11 + R22 + R33
     # angle
-    angle = np.arctan2(0.5*np.sqrt( np.power(R21-R12,2)+np.power(R31-R13,2)+np.power(R32-R23,2)), 0.5*(tr-1))
+    angle = np.arctan2(0.5*math.sqrt((R21-R12)*(R21-R12)+(R31-R13)*(R31-R13)+(R32-R23)*(R32-R23)), 0.5*(tr-1))
     # axis
     if angle!=0:
-        rx = (R32-R23)/(2*np.sin(angle))
-        ry = (R13-R31)/(2*np.sin(angle))
-        rz = (R21-R12)/(2*np.sin(angle))
-        axis = np.array([rx, ry, rz]) 
+        den = 2*float(np.sin(angle))
+        axis = np.array([(R32-R23)/den, (R13-R31)/den, (R21-R12)/den])
     else:
         axis = np.zeros(3)
     return angle, axis
@@ -189,6 +398,32 @@ def angleaxis2rot(w):
     """
     print("development...")
 
+def rot2quat_batch(R):
+    """
+    @info: computes quaternions from a stack of rotation matrices
+    
+    @input:
+    ------
+        - R: Rotation matrices [N x 3 x 3]
+    @output:
+    -------
+        - Q: Quaternions [N x 4] ([w, ex, ey, ez] each one)
+    """
+    dEpsilon = 1e-6
+    R = np.asarray(R, dtype=float)
+    R00, R11, R22 = R[...,0,0], R[...,1,1], R[...,2,2]
+
+    def component(diag, sign):
+        # zero if the radicand is (almost) zero
+        small = np.fabs(diag) < dEpsilon
+        return np.where(small, 0.0, 0.5*np.sign(sign)*np.sqrt(np.where(small, 0.0, diag)))
+
+    w  = 0.5*np.sqrt(R00+R11+R22+1.0)
+    ex = component(R00-R11-R22+1.0, R[...,2,1]-R[...,1,2])
+    ey = component(R11-R22-R00+1.0, R[...,0,2]-R[...,2,0])
+    ez = component(R22-R00-R11+1.0, R[...,1,0]-R[...,0,1])
+    return np.stack((w, ex, ey, ez), axis=-1)
+
 def rot2quat(R):
     """
     @info: computes quaternion from rotation matrix
@@ -200,24 +435,39 @@ def rot2quat(R):
     -------
         - Q: Quaternion [w, ex, ey, ez]
     """
+    # single matrix: python floats (the batch kernel is slower for one sample)
     dEpsilon = 1e-6
-    Q = np.zeros(4)
-    
-    Q[0] = 0.5*np.sqrt(R[0,0]+R[1,1]+R[2,2]+1.0)
-    if ( np.fabs(R[0,0]-R[1,1]-R[2,2]+1.0) < dEpsilon ):
-        Q[1] = 0.0
-    else:
-        Q[1] = 0.5*np.sign(R[2,1]-R[1,2])*np.sqrt(R[0,0]-R[1,1]-R[2,2]+1.0)
-    if ( np.fabs(R[1,1]-R[2,2]-R[0,0]+1.0) < dEpsilon ):
-        Q[2] = 0.0
-    else:
-        Q[2] = 0.5*np.sign(R[0,2]-R[2,0])*np.sqrt(R[1,1]-R[2,2]-R[0,0]+1.0)
-    if ( np.fabs(R[2,2]-R[0,0]-R[1,1]+1.0) < dEpsilon ):
-        Q[3] = 0.0
-    else:
-        Q[3] = 0.5*np.sign(R[1,0]-R[0,1])*np.sqrt(R[2,2]-R[0,0]-R[1,1]+1.0)
+    (R00, R01, R02), (R10, R11, R12), (R20, R21, R22) = np.asarray(R, dtype=float).tolist()
 
-    return Q      
+    def component(diag, sign):
+        # zero if the radicand is (almost) zero
+        if math.fabs(diag) < dEpsilon:
+            return 0.0
+        return 0.5*((sign > 0) - (sign < 0))*math.sqrt(diag)
+
+    return np.array([0.5*math.sqrt(R00+R11+R22+1.0),
+                     component(R00-R11-R22+1.0, R21-R12),
+                     component(R11-R22-R00+1.0, R02-R20),
+                     component(R22-R00-R11+1.0, R10-R01)])
+
+def quatError_batch(Qdes, Qmed):
+    """
+    @info: computes quaterion errors (Q_e = Q_d . Q_m*) of stacks of quaternions.
+
+    @inputs:
+    ------
+        - Qdes: desired quaternions [N x 4]
+        - Qmed: measured quaternions [N x 4]
+
+    @output:
+    -------
+        - Qe : quaternion errors [N x 4]
+    """
+    Qdes = np.asarray(Qdes, dtype=float)
+    Qmed = np.asarray(Qmed, dtype=float)
+    we = Qdes[...,0]*Qmed[...,0] + np.sum(Qdes[...,1:4]*Qmed[...,1:4], axis=-1) - 1
+    e  = -Qdes[...,0:1]*Qmed[...,1:4] + Qmed[...,0:1]*Qdes[...,1:4] - np.cross(Qdes[...,1:4], Qmed[...,1:4])
+    return np.concatenate((we[...,None], e), axis=-1)
 
 def quatError(Qdes, Qmed):
     """
@@ -232,12 +482,33 @@ def quatError(Qdes, Qmed):
     -------
         - Qe : quaternion error    
     """
-
-    we = Qdes[0]*Qmed[0] + np.dot(Qdes[1:4].T,Qmed[1:4]) - 1
-    e  = -Qdes[0]*Qmed[1:4] + Qmed[0]*Qdes[1:4] - np.cross(Qdes[1:4], Qmed[1:4])
-    Qe = np.array([ we, e[0], e[1], e[2] ])
-
-    return Qe               
+    # single quaternion: python floats (the batch kernel is slower for one sample)
+    d0, d1, d2, d3 = np.asarray(Qdes, dtype=float).tolist()
+    m0, m1, m2, m3 = np.asarray(Qmed, dtype=float).tolist()
+    we = d0*m0 + (d1*m1 + d2*m2 + d3*m3) - 1
+    return np.array([we, 
+                     -d0*m1 + m0*d1 - (d2*m3 - d3*m2),
+                     -d0*m2 + m0*d2 - (d3*m1 - d1*m3),
+                     -d0*m3 + m0*d3 - (d1*m2 - d2*m1)])
+
+def axisangle_error_batch(R_des, R_med):
+    """
+    @info: computes orientation errors of stacks of rotation matrices and 
+           represent them with angle/axis.
+    @inputs:
+    ------
+        - R_des: desired orientations [N x 3 x 3]
+        - R_med: measured orientations [N x 3 x 3]
+    @outputs:
+    --------
+        - e_o: orientation errors [N x 3]
+    """
+    R_des = np.asarray(R_des, dtype=float)
+    R_med = np.asarray(R_med, dtype=float)
+    R_e = np.matmul(np.swapaxes(R_med, -1, -2), R_des)
+    angle_e, axis_e = rot2axisangle_batch(R_e)
+    e_o = np.matmul(R_med, (angle_e[...,None]*axis_e)[...,None])[...,0] # w.r.t world frame
+    return e_o
 
 def axisangle_error(R_des, R_med):
     """
@@ -250,11 +521,40 @@ def axisangle_error(R_des, R_med):
     --------
         - e_o: orientation error        
     """
+    R_med = np.asarray(R_med, dtype=float)
     R_e = R_med.T.dot(R_des)
     angle_e, axis_e = rot2axisangle(R_e)
     e_o = R_med.dot(angle_e*axis_e) # w.r.t world frame
     return e_o
 
+def rpy2rot_batch(rpy):
+    """
+    @info: computes rotation matrices from a stack of roll, pitch, yaw (ZYX euler angles)
+    
+    @inputs:
+    -------
+        - rpy: [N x 3] roll (z-axis), pitch (y-axis) and yaw (x-axis) angles
+    @outputs:
+    --------
+        - R: rotation matrices [N x 3 x 3]
+    """
+    rpy = np.asarray(rpy, dtype=float)
+    cz, sz = np.cos(rpy[...,0]), np.sin(rpy[...,0])
+    cy, sy = np.cos(rpy[...,1]), np.sin(rpy[...,1])
+    cx, sx = np.cos(rpy[...,2]), np.sin(rpy[...,2])
+    # R = Rz*Ry*Rx
+    R = np.empty(rpy.shape[:-1] + (3,3))
+    R[...,0,0] = cz*cy
+    R[...,0,1] = cz*sy*sx - sz*cx
+    R[...,0,2] = cz*sy*cx + sz*sx
+    R[...,1,0] = sz*cy
+    R[...,1,1] = sz*sy*sx + cz*cx
+    R[...,1,2] = sz*sy*cx - cz*sx
+    R[...,2,0] = -sy
+    R[...,2,1] = cy*sx
+    R[...,2,2] = cy*cx
+    return R
+
 def rpy2rot(rpy):
     """
     @info: computes rotation matrix from roll, pitch, yaw (ZYX euler angles) representation
@@ -268,20 +568,37 @@ def rpy2rot(rpy):
     --------
         - R: rotation matrix        
     """
-    Rz = np.array([[ np.cos(rpy[0])  ,  -np.sin(rpy[0]) ,      0],
-                [    np.sin(rpy[0])  ,   np.cos(rpy[0]) ,      0],
-                [           0      ,        0       ,      1]])
-
-    Ry = np.array([[np.cos(rpy[1])   ,   0   ,   np.sin(rpy[1])],
-                [      0            ,   1   ,           0],
-                [  -np.sin(rpy[1])   ,   0   ,   np.cos(rpy[1])]])
-
-    Rx =  np.array([ [   1   ,    0           ,        0], 
-                        [0   ,    np.cos(rpy[2]) ,  -np.sin(rpy[2])],
-                        [0   ,    np.sin(rpy[2]) ,   np.cos(rpy[2])]])
-
-    R =  np.dot(np.dot(Rz, Ry), Rx)
-    return R
+    # single sample: python floats (the batch kernel is slower for one sample)
+    rpy = np.asarray(rpy, dtype=float)
+    cz, cy, cx = np.cos(rpy).tolist()
+    sz, sy, sx = np.sin(rpy).tolist()
+    # R = Rz*Ry*Rx
+    return np.array([[cz*cy, cz*sy*sx - sz*cx, cz*sy*cx + sz*sx],
+                     [sz*cy, sz*sy*sx + cz*cx, sz*sy*cx - cz*sx],
+                     [  -sy,            cy*sx,            cy*cx]])
+
+def rot2rpy_batch(R):
+    """
+    @info: computes roll, pitch, yaw (ZYX euler angles) from a stack of rotation matrices
+    
+    @inputs:
+    -------
+        - R: rotation matrices [N x 3 x 3]
+    @outputs:
+    --------
+        - rpy: [N x 3] roll (z-axis), pitch (y-axis) and yaw (x-axis) angles
+    """
+    R = np.asarray(R, dtype=float)
+    R32 = R[...,2,1]
+    R31 = R[...,2,0]
+    R33 = R[...,2,2]
+    R21 = R[...,1,0]
+    R11 = R[...,0,0]
+    pitch = np.arctan2(-R31, np.sqrt(R32*R32 + R33*R33))
+    cp = np.cos(pitch)
+    roll = np.arctan2(R21/cp, R11/cp)
+    yaw = np.arctan2(R32/cp, R33/cp)
+    return np.stack((roll, pitch, yaw), axis=-1)
 
 def rot2rpy(R):
     """
@@ -296,17 +613,67 @@ def rot2rpy(R):
         - rpy[1]: rotation in y-axis (pitch)
         - rpy[2]: rotation in x-axis (yaw)
     """
-    R32 = R[2,1]
-    R31 = R[2,0]
-    R33 = R[2,2]
-    R21 = R[1,0]
-    R11 = R[0,0]
-    rpy = np.zeros(3)    
-    rpy[1] = np.arctan2(-R31, np.sqrt(R32*R32 + R33*R33))
-    rpy[0] = np.arctan2(R21/np.cos(rpy[1]), R11/np.cos(rpy[1]))
-    rpy[2] = np.arctan2(R32/np.cos(rpy[1]), R33/np.cos(rpy[1]))
+    # single matrix: python floats (the batch kernel is slower for one sample)
+    (R11, _, _), (R21, _, _), (R31, R32, R33) = np.asarray(R, dtype=float).tolist()
+    pitch = np.arctan2(-R31, math.sqrt(R32*R32 + R33*R33))
+    cp = float(np.cos(pitch))
+    roll, yaw = np.arctan2([R21/cp, R32/cp], [R11/cp, R33/cp]).tolist()
+    return np.array([roll, pitch, yaw])
+
+def unwrap_rpy(rpy, rpy_old):
+    """
+    @info: unwraps a sequence of euler angles: each sample is shifted by +-2pi when it jumps
+           more than pi w.r.t. the previous (unwrapped) sample. It gives the same result as
+           calling rot2rpy_unwrapping sample by sample.
 
-    return rpy
+    @inputs:
+    -------
+        - rpy: sequence of angles in [-pi, pi] [N x 3]
+        - rpy_old: unwrapped angles before the first sample [3]
+    @outputs:
+    --------
+        - rpy: unwrapped angles [N x 3]
+    """
+    rpy = np.asarray(rpy, dtype=float)
+    rpy_old = np.asarray(rpy_old, dtype=float)
+    if rpy.shape[0] == 0:
+        return rpy.copy()
+
+    def shift(x, x_old):
+        # shift (-1, 0, +1) stored as index (0, 1, 2)
+        return np.where(x<=(x_old-np.pi), 2, np.where(x>=(x_old+np.pi), 0, 1))
+
+    def shifted(x, k):
+        # same floating point operations as "rpy += 2*np.pi" and "rpy -= 2*np.pi"
+        return np.where(k==2, x+2*np.pi, np.where(k==0, x-2*np.pi, x))
+
+    # the shift of each sample only depends on the shift of the previous one: 
+    # table[i, k] is the shift of sample i when the shift of sample i-1 is k
+    n = rpy.shape[0]
+    table = np.empty((n, 3) + rpy.shape[1:], dtype=np.intp)
+    table[0] = shift(rpy[0], rpy_old)
+    for k in range(3):
+        table[1:, k] = shift(rpy[1:], shifted(rpy[:-1], k))
+    # prefix composition of the tables (log2(n) vectorized steps)
+    step = 1
+    while step < n:
+        table[step:] = np.take_along_axis(table[step:], table[:-step], axis=1)
+        step *= 2
+    return shifted(rpy, table[:, 0])
+
+def rot2rpy_unwrapping_batch(R, rpy_old):
+    """
+    @info: computes unwrapped roll, pitch, yaw (ZYX euler angles) from a sequence of rotation matrices
+    
+    @inputs:
+    -------
+        - R: rotation matrices [N x 3 x 3]
+        - rpy_old: unwrapped angles before the first sample [3]
+    @outputs:
+    --------
+        - rpy: [N x 3] roll (z-axis), pitch (y-axis) and yaw (x-axis) angles
+    """
+    return unwrap_rpy(rot2rpy_batch(R), rpy_old)
 
 def rot2rpy_unwrapping(R, rpy_old):
     """
@@ -321,24 +688,61 @@ def rot2rpy_unwrapping(R, rpy_old):
         - rpy[1]: rotation in y-axis (pitch)
         - rpy[2]: rotation in x-axis (yaw)
     """
-    R32 = R[2,1]
-    R31 = R[2,0]
-    R33 = R[2,2]
-    R21 = R[1,0]
-    R11 = R[0,0]
-    rpy = np.zeros(3)    
-    rpy[1] = np.arctan2(-R31, np.sqrt(R32*R32 + R33*R33))
-    rpy[0] = np.arctan2(R21/np.cos(rpy[1]), R11/np.cos(rpy[1]))
-    rpy[2] = np.arctan2(R32/np.cos(rpy[1]), R33/np.cos(rpy[1]))
-
+    rpy = rot2rpy(R)
     for i in range(3):
         if(rpy[i]<=(rpy_old[i]-np.pi)):
             rpy[i] +=2*np.pi
         elif(rpy[i]>=(rpy_old[i]+np.pi)):
             rpy[i] -=2*np.pi 
-    return rpy 
+    return rpy
 
 
+def rpy_rates_batch(rpy, drpy=None, ddrpy=None, w=None, eps=1e-6):
+    """
+    @info: euler-rate kinematics of roll, pitch, yaw (ZYX euler angles): w = E0 drpy, 
+           dw = E1 drpy + E0 ddrpy and drpy = E0^-1 w (closed form). The trigonometric terms
+           are computed once for all the requested outputs.
+    @inputs:
+    -------
+        - rpy: roll (z-axis), pitch (y-axis) and yaw (x-axis) angles [N x 3]
+        - drpy: rotation ratios [N x 3] (optional, needed for w and dw)
+        - ddrpy: rotation accelerations [N x 3] (optional, needed for dw)
+        - w: angular velocities [N x 3] (optional, needed for the rotation ratios)
+        - eps: smallest |cos(pitch)| used by E0^-1 (singularity at pitch = +-pi/2)
+    @outputs:
+    --------
+        - w: angular velocities [N x 3] (None without drpy)
+        - dw: angular accelerations [N x 3] (None without drpy and ddrpy)
+        - drpy: rotation ratios of the angular velocities w [N x 3] (None without w)
+    """
+    rpy = np.asarray(rpy, dtype=float)
+    s = np.sin(rpy[...,0:2])
+    c = np.cos(rpy[...,0:2])
+    sa, sb = s[...,0], s[...,1]
+    ca, cb = c[...,0], c[...,1]
+    w_out = dw_out = drpy_out = None
+    if drpy is not None:
+        drpy = np.asarray(drpy, dtype=float)
+        da, db, dc = drpy[...,0], drpy[...,1], drpy[...,2]
+        # w = E0 drpy
+        cacb, sacb = ca*cb, sa*cb
+        w_out = np.stack((-sa*db + cacb*dc, ca*db + sacb*dc, da - sb*dc), axis=-1)
+        if ddrpy is not None:
+            ddrpy = np.asarray(ddrpy, dtype=float)
+            dda, ddb, ddc = ddrpy[...,0], ddrpy[...,1], ddrpy[...,2]
+            # dw = E1 drpy + E0 ddrpy
+            dw_out = np.stack((-ca*da*db + (-sa*da*cb - ca*sb*db)*dc - sa*ddb + cacb*ddc,
+                               -sa*da*db + ( ca*da*cb - sa*sb*db)*dc + ca*ddb + sacb*ddc,
+                               -cb*db*dc + dda - sb*ddc), axis=-1)
+    if w is not None:
+        w = np.asarray(w, dtype=float)
+        wx, wy, wz = w[...,0], w[...,1], w[...,2]
+        # drpy = E0^-1 w, with |cos(pitch)| >= eps
+        cb = np.where(np.abs(cb) < eps, np.copysign(eps, cb), cb)
+        dc = (ca*wx + sa*wy)/cb
+        drpy_out = np.stack((wz + sb*dc, -sa*wx + ca*wy, dc), axis=-1)
+    return w_out, dw_out, drpy_out
+
 def rpy2angularVel(rpy, drpy):
     """
     @info: compute angular velocity (w) from euler angles (roll, pitch and yaw) and its derivaties
@@ -353,13 +757,13 @@ def rpy2angularVel(rpy, drpy):
     @outputs:
     --------
         - w: angular velocity
-    """        
-    E0 = np.array(  [[0, -np.sin(rpy[0]), np.cos(rpy[0])*np.cos(rpy[1])], \
-                    [0,   np.cos(rpy[0]), np.sin(rpy[0])*np.cos(rpy[1])], \
-                    [1,         0,          -np.sin(rpy[1])       ]])
-    
-    w = np.dot(E0, drpy)
-    return w
+    """
+    # single sample: python floats (same operations as rpy_rates_batch)
+    rpy = np.asarray(rpy, dtype=float)
+    sa, sb = np.sin(rpy[0:2]).tolist()
+    ca, cb = np.cos(rpy[0:2]).tolist()
+    da, db, dc = np.asarray(drpy, dtype=float).tolist()
+    return np.array([-sa*db + ca*cb*dc, ca*db + sa*cb*dc, da - sb*dc])
 
 def angularVel2rpy(w, rpy):
     """
@@ -376,13 +780,16 @@ def angularVel2rpy(w, rpy):
         - drpy[1]: rotation ratio in y-axis
         - drpy[2]: rotation ratio in x-axis
 
-    """        
-    E0 = np.array(  [[0, -np.sin(rpy[0]), np.cos(rpy[0])*np.cos(rpy[1])], \
-                    [0,   np.cos(rpy[0]), np.sin(rpy[0])*np.cos(rpy[1])], \
-                    [1,         0,          -np.sin(rpy[1])       ]])
-    
-    drpy = np.dot(inv(E0), w)
-    return drpy
+    """
+    # single sample: python floats (same operations as rpy_rates_batch)
+    rpy = np.asarray(rpy, dtype=float)
+    sa, sb = np.sin(rpy[0:2]).tolist()
+    ca, cb = np.cos(rpy[0:2]).tolist()
+    wx, wy, wz = np.asarray(w, dtype=float).tolist()
+    if abs(cb) < 1e-6:
+        cb = math.copysign(1e-6, cb)
+    dc = (ca*wx + sa*wy)/cb
+    return np.array([wz + sb*dc, -sa*wx + ca*wy, dc])
 
 def rpy2angularAccel(rpy, drpy, ddrpy):
     """
@@ -401,33 +808,661 @@ def rpy2angularAccel(rpy, drpy, ddrpy):
     @outputs:
     --------
         - dw: angular acceleration
-    """        
-    E0 = np.array(  [[0, -np.sin(rpy[0]), np.cos(rpy[0])*np.cos(rpy[1])], \
-                    [0,   np.cos(rpy[0]), np.sin(rpy[0])*np.cos(rpy[1])], \
-                    [1,         0,          -np.sin(rpy[1])       ]])
-    
-    E1 = np.array( [[0, -np.cos(rpy[0])*drpy[0], -np.sin(rpy[0])*drpy[0]*np.cos(rpy[1])-np.cos(rpy[0])*np.sin(rpy[1])*drpy[1]], \
-                    [0, -np.sin(rpy[0])*drpy[0],  np.cos(rpy[0])*drpy[0]*np.cos(rpy[1])-np.sin(rpy[0])*np.sin(rpy[1])*drpy[1]], \
-                    [0,         0,               -np.cos(rpy[1])*drpy[1]   ]])
-    dw = np.dot(E1, drpy) + np.dot(E0, ddrpy)
-    return dw
+    """
+    # single sample: python floats (same operations as rpy_rates_batch)
+    rpy = np.asarray(rpy, dtype=float)
+    sa, sb = np.sin(rpy[0:2]).tolist()
+    ca, cb = np.cos(rpy[0:2]).tolist()
+    da, db, dc = np.asarray(drpy, dtype=float).tolist()
+    dda, ddb, ddc = np.asarray(ddrpy, dtype=float).tolist()
+    cacb, sacb = ca*cb, sa*cb
+    return np.array([-ca*da*db + (-sa*da*cb - ca*sb*db)*dc - sa*ddb + cacb*ddc,
+                     -sa*da*db + ( ca*da*cb - sa*sb*db)*dc + ca*ddb + sacb*ddc,
+                     -cb*db*dc + dda - sb*ddc])
+
+def damping_term(A, lambda_=0.0000001, epsilon=None, lambda_max=0.01):
+    """
+    @info: damping term of M M^T, increased near singularities (singular value based damping)
+
+    @inputs:
+    ------
+        - A: M M^T (without damping) [m x m] or [N x m x m]
+        - lambda_: damping term
+        - epsilon: smallest singular value of M without extra damping (optional, None: constant damping)
+        - lambda_max: extra damping when the smallest singular value is zero
+    @outputs:
+    -------
+        - lambda_: damping term (scalar or [N])
+    """
+    if epsilon is None:
+        return lambda_
+    # squared singular values of M are the eigenvalues of M M^T
+    s2_min = np.maximum(np.linalg.eigvalsh(A)[..., 0], 0.0)
+    return lambda_ + np.where(s2_min < epsilon**2, lambda_max*(1.0 - s2_min/epsilon**2), 0.0)
 
-def damped_pinv(M, lambda_=0.0000001):
+def damped_least_squares(M, e, lambda_=0.0000001, epsilon=None, lambda_max=0.01):
+    """
+    @info: computes M^T (M M^T + lambda I)^-1 e with a linear solve (no explicit inverse)
+
+    @inputs:
+    ------
+        - M: matrix [m x n] or [N x m x n]
+        - e: vector [m] or [N x m]
+        - lambda_: damping term (optional)
+        - epsilon, lambda_max: singular value based damping (optional, see damping_term)
+    @outputs:
+    -------
+        - x: damped least-squares solution [n] or [N x n]
+    """
+    M = np.asarray(M, dtype=float)
+    A = mx(M, np.swapaxes(M, -1, -2))
+    lambda_ = damping_term(A, lambda_, epsilon, lambda_max)
+    ntask = M.shape[-2]
+    A[..., range(ntask), range(ntask)] += np.asarray(lambda_)[..., None]
+    y = np.linalg.solve(A, np.asarray(e, dtype=float)[..., None])
+    return mx(np.swapaxes(M, -1, -2), y)[..., 0]
+
+def damped_pinv(M, lambda_=0.0000001, epsilon=None, lambda_max=0.01):
     """
     @info: computes damped pseudo-inverse
 
     @inputs:
     ------
-        - M: matrix
+        - M: matrix [m x n] or [N x m x n]
         - lambda_: damping term (optional)
+        - epsilon, lambda_max: singular value based damping (optional, see damping_term)
     @outputs:
     -------
         - M_damped_inv: damped psedu-inverse of M            
     """
-    ntask = M.shape[0]
-    M_damped_inv =  np.dot(M.T, np.linalg.inv(np.dot(M, M.T) + lambda_*np.eye(ntask)))
+    M = np.asarray(M, dtype=float)
+    A = mx(M, np.swapaxes(M, -1, -2))
+    lambda_ = damping_term(A, lambda_, epsilon, lambda_max)
+    ntask = M.shape[-2]
+    A[..., range(ntask), range(ntask)] += np.asarray(lambda_)[..., None]
+    # M^T A^-1 = (A^-1 M)^T since A is symmetric
+    M_damped_inv = np.swapaxes(np.linalg.solve(A, M), -1, -2)
     return M_damped_inv
 
+class DampedLeastSquares(object):
+    """
+    @info: damped least-squares solver for a fixed task dimension: x = M^T (M M^T + lambda I)^-1 e.
+           The matrix M M^T is built in a preallocated buffer and solved with a cholesky 
+           factorization (lapack if scipy is available), without explicit inverse.
+
+    @inputs:
+    -------
+        - ntask: task dimension (rows of M)
+        - lambda_: damping term
+        - epsilon: smallest singular value of M without extra damping (optional, None: constant damping)
+        - lambda_max: extra damping when the smallest singular value is zero
+
+    @methods:
+        - solve(M, e, lambda_)
+    """
+    def __init__(self, ntask, lambda_=0.0000001, epsilon=None, lambda_max=0.01):
+        self.ntask = ntask
+        self.lambda_ = lambda_
+        self.epsilon = epsilon
+        self.lambda_max = lambda_max
+        # fortran order: lapack factorizes the buffer in place
+        self.A = np.zeros((ntask, ntask), order='F')
+        self.A_diag = self.A.T.reshape(-1)[::ntask+1]
+
+    def solve(self, M, e, lambda_=None):
+        """
+        @info: computes the damped least-squares solution
+        @inputs:
+        -------
+            - M: matrix [ntask x n] ([N x ntask x n] is solved by damped_least_squares)
+            - e: vector [ntask]
+            - lambda_: damping term (optional, default: self.lambda_)
+        @outputs:
+        --------
+            - x: damped least-squares solution [n]
+        """
+        if lambda_ is None:
+            lambda_ = self.lambda_
+        if np.ndim(M) > 2:
+            return damped_least_squares(M, e, lambda_, self.epsilon, self.lambda_max)
+        A = self.A
+        np.dot(M, M.T, out=A.T)
+        if self.epsilon is not None:
+            lambda_ = damping_term(A, lambda_, self.epsilon, self.lambda_max)
+        self.A_diag += lambda_
+        if dpotrf is not None:
+            c, info = dpotrf(A, lower=1, overwrite_a=1, clean=0)
+            if info == 0:
+                y, info = dpotrs(c, e, lower=1)
+                return np.dot(M.T, y)
+            # not positive definite (no damping and singular M): the buffer was overwritten
+            np.dot(M, M.T, out=A.T)
+            self.A_diag += lambda_
+        return np.dot(M.T, np.linalg.solve(A, e))
+
+def forward_dynamics(model, data, q, dq, tau, method='aba', M=None, b=None):
+    """
+    @info: computes joint acceleration (ddq) from joint torques (tau)
+
+    @inputs:
+    ------
+        - model, data: pinocchio model and data
+        - q, dq: joint position and velocity
+        - tau: joint torques
+        - method: 'aba' (articulated body algorithm), 'cholesky' (sparse cholesky 
+                  factorization of M) or 'inverse' (explicit inverse of M, reference)
+        - M, b: inertia matrix and nonlinear effects at (q, dq), if already known (optional)
+    @outputs:
+    -------
+        - ddq: joint acceleration
+        - M, b: inertia matrix and nonlinear effects (None if the method does not need them)
+    """
+    if method == 'aba':
+        ddq = pin.aba(model, data, q, dq, tau)
+    elif method == 'cholesky':
+        if M is None:
+            M = pin.crba(model, data, q)
+        else:
+            data.M = M
+        if b is None:
+            b = pin.nonLinearEffects(model, data, q, dq)
+        pin.cholesky.decompose(model, data)
+        ddq = pin.cholesky.solve(model, data, tau-b)
+    elif method == 'inverse':
+        if M is None:
+            M = pin.crba(model, data, q)
+        if b is None:
+            b = pin.rnea(model, data, q, dq, np.zeros(model.nv))
+        ddq = np.linalg.inv(M).dot(tau-b)
+    else:
+        raise ValueError("unknown forward dynamics method: {}".format(method))
+    return ddq, M, b
+
+def run_blocks(fn, n, n_workers=None, args=()):
+    """
+    @info: splits the indices 0, ..., n-1 in contiguous blocks and runs fn(block, *args) for each
+           block in a pool of processes (in the calling process if there is only one block).
+           Pinocchio does not release the GIL, so threads would run the blocks one at a time.
+
+    @inputs:
+    -------
+        - fn: function of a block of indices. It must be a function of a module, because it is
+              sent to the processes with its arguments (pinocchio models can be sent)
+        - n: number of indices
+        - n_workers: number of processes (optional, default: number of cores)
+        - args: other arguments of fn
+    @outputs:
+    --------
+        - results: fn(block, *args) of each block, in the order of the blocks
+    """
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+    blocks = np.array_split(np.arange(n), max(1, min(n_workers, n)))
+    if len(blocks) == 1:
+        return [fn(blocks[0], *args)]
+    with ProcessPoolExecutor(len(blocks)) as pool:
+        # list() propagates the exceptions raised inside the processes
+        return list(pool.map(fn, blocks, *[repeat(arg, len(blocks)) for arg in args]))
+
+def _ik_block(block, model, frame_ee, settings, x_des, q0, R_des):
+    """
+    @info: inverse kinematics of the targets of a block (see Robot.inverse_kinematics_batch)
+    """
+    ik = IKSolver(KinematicsCache(model, model.createData(), frame_ee), *settings)
+    q = np.zeros((len(block), model.nq))
+    residual = np.zeros(len(block))
+    for j, i in enumerate(block):
+        q[j] = ik.solve(x_des[i], q0[i], None if R_des is None else R_des[i])
+        residual[j] = ik.error
+    return q, residual
+
+def _ik_chunk(ik, x_des, R_des, start, stop, seed):
+    """
+    @info: inverse kinematics of the samples start, ..., stop-1 of a trajectory. Each sample 
+           is warm-started from the solution of the previous one
+    """
+    q = np.zeros((stop - start, ik.kin.model.nq))
+    residual = np.zeros(stop - start)
+    for j, i in enumerate(range(start, stop)):
+        seed = q[j] = ik.solve(x_des[i], seed, None if R_des is None else R_des[i])
+        residual[j] = ik.error
+    return q, residual
+
+def _ik_chunk_block(block, model, frame_ee, settings, bounds, seeds, x_des, R_des):
+    """
+    @info: chunks of a block (see Robot.inverse_kinematics_trajectory)
+    """
+    ik = IKSolver(KinematicsCache(model, model.createData(), frame_ee), *settings)
+    return [_ik_chunk(ik, x_des, R_des, bounds[k][0], bounds[k][1], seeds[k]) for k in block]
+
+def _fk_block(block, model, frame_ee, q):
+    """
+    @info: end-effector pose of the configurations of a block (see WorkspaceIndex.build)
+    """
+    kin = KinematicsCache(model, model.createData(), frame_ee)
+    p = np.zeros((len(block), 3))
+    R = np.zeros((len(block), 3, 3))
+    for j, i in enumerate(block):
+        kin.update(q[i])
+        p[j], R[j] = kin.p, kin.R
+    return p, R
+
+def affine_scan(A, b, x0):
+    """
+    @info: states of the recursion x[k] = A[k] x[k-1] + b[k] from x[-1] = x0, computed with
+           a prefix composition of the affine maps (log2(N) vectorized steps)
+
+    @inputs:
+    -------
+        - A: matrices [N x n x n]
+        - b: vectors of several signals [N x n x m]
+        - x0: initial states [n x m]
+    @outputs:
+    --------
+        - x: states [N x n x m]
+    """
+    A = np.array(A, dtype=float)
+    b = np.array(b, dtype=float)
+    n = A.shape[0]
+    step = 1
+    while step < n:
+        # (A2, b2) o (A1, b1) = (A2 A1, A2 b1 + b2)
+        b[step:] = mx(A[step:], b[:-step]) + b[step:]
+        A[step:] = mx(A[step:], A[:-step])
+        step *= 2
+    return mx(A, x0) + b
+
+class KinematicsCache(object):
+    """
+    @info: stores the kinematic passes of a frame computed by pinocchio for the last joint
+           state (q, dq). Each pass is computed once per state and shared by all the queries. 
+
+    @inputs:
+    -------
+        - model, data: pinocchio model and data
+        - frame_id: frame id (end-effector)
+
+    @levels:
+        - PLACEMENT: position (p) and rotation (R) of the frame
+        - JACOBIAN: placement and geometric jacobian (J)
+        - JACOBIAN_DOT: placement, jacobian and its time-derivative (dJ)
+    """
+    PLACEMENT = 1
+    JACOBIAN = 2
+    JACOBIAN_DOT = 3
+
+    def __init__(self, model, data, frame_id):
+        self.model = model
+        self.data = data
+        self.frame_id = frame_id
+        # joint state of the stored passes
+        self.q = None
+        self.dq = None
+        self.level = 0
+        # bytes of the joint state: compared in each query (cheaper than np.array_equal)
+        self.q_key = None
+        self.dq_key = None
+        # stored passes
+        self.p = np.zeros(3)
+        self.R = np.zeros([3,3])
+        self.J = None
+        self.dJ = None
+        # counters: queries served from the stored passes and pinocchio passes 
+        self.hits = 0
+        self.recomputes = 0
+
+    def update(self, q, dq=None, level=1):
+        """
+        @info: makes sure that the passes up to "level" are computed at (q, dq).
+               dq is only needed for the JACOBIAN_DOT level.
+        """
+        q_key = np.asarray(q, dtype=float).tobytes()
+        if q_key != self.q_key:
+            self.q = np.array(q, dtype=float)
+            self.q_key = q_key
+            self.level = 0
+        if level >= self.JACOBIAN_DOT:
+            dq_key = np.asarray(dq, dtype=float).tobytes()
+            if dq_key != self.dq_key:
+                self.dq = np.array(dq, dtype=float)
+                self.dq_key = dq_key
+                self.level = min(self.level, self.JACOBIAN)
+        if self.level >= level:
+            self.hits += 1
+            return self
+        # a single pinocchio pass computes the placement and the requested jacobians
+        self.recomputes += 1
+        if level >= self.JACOBIAN_DOT:
+            pin.computeJointJacobiansTimeVariation(self.model, self.data, self.q, self.dq)
+        elif level == self.JACOBIAN:
+            pin.computeJointJacobians(self.model, self.data, self.q)
+        else:
+            pin.forwardKinematics(self.model, self.data, self.q)
+        placement = pin.updateFramePlacement(self.model, self.data, self.frame_id)
+        self.p = np.array(placement.translation)
+        self.R = np.array(placement.rotation)
+        if level >= self.JACOBIAN:
+            self.J = pin.getFrameJacobian(self.model, self.data, self.frame_id, pin.ReferenceFrame.LOCAL_WORLD_ALIGNED)
+        if level >= self.JACOBIAN_DOT:
+            self.dJ = pin.getFrameJacobianTimeVariation(self.model, self.data, self.frame_id, pin.ReferenceFrame.LOCAL_WORLD_ALIGNED)
+        self.level = level
+        return self
+
+    def reset_counters(self):
+        self.hits = 0
+        self.recomputes = 0
+
+class IKSolver(object):
+    """
+    @info: inverse kinematics of the end-effector with the damped least-squares method. The
+           damping is adapted as in Levenberg-Marquardt: it decreases after a step that reduces 
+           the error and increases after a rejected step. The solver stops when the error norm 
+           is below "tol" and keeps the joints inside the limits of the .urdf.
+
+    @inputs:
+    -------
+        - kin: kinematic passes of the end-effector (KinematicsCache), only its pinocchio data is used
+        - max_iter: maximum number of iterations
+        - tol: tolerance of the error norm
+        - lambda_: initial (and minimum) damping term
+        - lambda_max: maximum damping term
+        - line_search: True to halve a step that does not reduce the error (up to 4 times)
+        - clamp: True to clamp the joints to the position limits of the model
+
+    @outputs (last solve):
+    --------
+        - iterations: number of iterations
+        - error: error norm at the solution
+        - converged: True if error < tol
+    """
+    def __init__(self, kin, max_iter=10, tol=1e-6, lambda_=0.0000001, lambda_max=100.0, line_search=False, clamp=True):
+        self.kin = kin
+        self.max_iter = max_iter
+        self.tol = tol
+        self.lambda_ = lambda_
+        self.lambda_max = lambda_max
+        self.line_search = line_search
+        self.min_step = 1.0/16
+        self.clamp = clamp
+        # joint limits (joints without limits have lower >= upper)
+        self.lower = np.array(kin.model.lowerPositionLimit)
+        self.upper = np.array(kin.model.upperPositionLimit)
+        self.limited = self.lower < self.upper
+        # damped least-squares solvers for position [3] and pose [6] tasks
+        self.dls = {3: DampedLeastSquares(3, lambda_), 6: DampedLeastSquares(6, lambda_)}
+        # statistics of the last solve
+        self.iterations = 0
+        self.error = np.inf
+        self.converged = False
+
+    def clamp_limits(self, q):
+        """
+        @info: clamps the joint position to the limits of the model
+        """
+        if not self.clamp:
+            return q
+        return np.where(self.limited, np.clip(q, self.lower, self.upper), q)
+
+    def task_error(self, q, x_des, R_des=None):
+        """
+        @info: error of the end-effector (position [3] or position and orientation [6]) 
+               and its jacobian at q
+        """
+        kin = self.kin.update(q, level=KinematicsCache.JACOBIAN)
+        e = x_des[0:3] - kin.p
+        if R_des is None:
+            return e, kin.J[0:3,:]
+        return np.concatenate((e, axisangle_error(R_des, kin.R)), axis=0), kin.J
+
+    def solve(self, x_des, q0, R_des=None, max_iter=None):
+        """
+        @info: computes joint position (q) from cartesian position (xyz) and, optionally,
+               orientation (R_des). 
+        @inputs:
+        -------
+            - x_des: desired cartesian position
+            - q0: initial joint configuration (it's very important)
+            - R_des: desired rotation matrix (optional, only position if None)
+            - max_iter: maximum number of iterations (optional, default: self.max_iter)
+        @outputs:
+        --------        
+            - q: joint position with the lowest error
+        """
+        if max_iter is None:
+            max_iter = self.max_iter
+        lambda_ = self.lambda_
+        q = self.clamp_limits(np.array(q0, dtype=float))
+        e, J = self.task_error(q, x_des, R_des)
+        norm_e = np.linalg.norm(e)
+        self.iterations = 0
+        while norm_e >= self.tol and self.iterations < max_iter:
+            self.iterations += 1
+            dq = self.dls[J.shape[0]].solve(J, e, lambda_)
+            step = 1.0
+            while True:
+                q_new = self.clamp_limits(q + step*dq)
+                e_new, J_new = self.task_error(q_new, x_des, R_des)
+                norm_new = np.linalg.norm(e_new)
+                if norm_new < norm_e or not self.line_search or step <= self.min_step:
+                    break
+                step *= 0.5
+            if norm_new < norm_e:
+                # step accepted: less damping (gauss-newton)
+                q, e, J, norm_e = q_new, e_new, J_new, norm_new
+                lambda_ = max(0.1*lambda_, self.lambda_)
+            else:
+                # step rejected: more damping (gradient descent)
+                lambda_ = min(10.0*lambda_, self.lambda_max)
+        self.error = norm_e
+        self.converged = norm_e < self.tol
+        return q
+
+class DifferentialIKTracker(object):
+    """
+    @info: streaming inverse kinematics for online control. It holds the last joint solution and
+           takes one damped least-squares step per control tick with the jacobian and pose that 
+           the Robot already computed for its current state (no extra pinocchio passes when they
+           were already read in the tick), plus an optional feed-forward cartesian velocity.
+           The step is taken from that state, and the solution stays inside the joint limits.
+
+    @inputs:
+    -------
+        - robot: Robot object
+        - q0: initial joint solution (optional, default: robot.q)
+        - gain: fraction of the pose error corrected in each tick (0, 1]
+        - lambda_: damping term of the pseudo-inverse
+
+    @methods:
+        - update(x_des, R_des, v_des, q)
+    """
+    def __init__(self, robot, q0=None, gain=1.0, lambda_=0.0001):
+        self.robot = robot
+        self.q = np.array(robot.q if q0 is None else q0, dtype=float)
+        self.dq = np.zeros(robot.ndof)
+        self.gain = gain
+        self.lambda_ = lambda_
+        self.dls = {3: DampedLeastSquares(3, lambda_), 6: DampedLeastSquares(6, lambda_)}
+
+    def update(self, x_des, R_des=None, v_des=None, q=None):
+        """
+        @info: computes the joint solution of the next tick
+        @inputs:
+        -------
+            - x_des: desired cartesian position
+            - R_des: desired rotation matrix (optional, only position if None)
+            - v_des: feed-forward velocity: linear [3] or linear and angular [6] (optional)
+            - q: joint state where the jacobian and the pose error are evaluated 
+                 (optional, default: current state of the robot)
+        @outputs:
+        --------
+            - q: joint solution
+            - dq: joint velocity of the solution
+        """
+        dt = self.robot.dt
+        # the step starts from the state where the error is evaluated: when the robot lags its
+        # reference, the same error is not added again in each tick
+        q_eval = np.array(self.robot.q if q is None else q, dtype=float)
+        kin = self.robot.kinematics.update(q_eval, level=KinematicsCache.JACOBIAN)
+        e = x_des[0:3] - kin.p
+        J = kin.J[0:3,:]
+        if R_des is not None:
+            e = np.concatenate((e, axisangle_error(R_des, kin.R)), axis=0)
+            J = kin.J
+        e = self.gain*e
+        if v_des is not None:
+            e = e + dt*np.asarray(v_des, dtype=float)
+        q_next = self.robot.ik.clamp_limits(q_eval + self.dls[J.shape[0]].solve(J, e, self.lambda_))
+        self.dq = (q_next - self.q)/dt
+        self.q = q_next
+        return self.q, self.dq
+
+class WorkspaceIndex(object):
+    """
+    @info: precomputed samples of the workspace (joint configuration and end-effector pose) 
+           stored in a spatial index (KD-tree if scipy is available). It gives the nearest
+           known configuration of a target, used as IK seed, and rejects unreachable targets.
+
+    @inputs:
+    -------
+        - q: joint configurations [N x ndof]
+        - p: end-effector positions [N x 3]
+        - R: end-effector rotation matrices [N x 3 x 3]
+        - reach_tol: a target farther than reach_tol from every sample is unreachable [m]
+                     (optional, default: twice the spacing of the samples)
+        - orientation_weight: weight of the orientation distance [m/rad] for pose targets
+
+    @methods:
+        - build(robot, n_samples) (class method)
+        - save(path), load(path) (class method)
+        - nearest(x_des, R_des)
+        - seed(x_des, R_des)
+        - reachable(x_des)
+    """
+    def __init__(self, q, p, R, reach_tol=None, orientation_weight=0.3):
+        self.q = np.asarray(q, dtype=float)
+        self.p = np.asarray(p, dtype=float)
+        self.R = np.asarray(R, dtype=float)
+        self.orientation_weight = orientation_weight
+        self.tree = cKDTree(self.p) if cKDTree is not None else None
+        self.reach_tol = reach_tol if reach_tol is not None else 2*self.spacing()
+
+    def spacing(self, n_test=1000):
+        """
+        @info: distance between neighbor samples (99th percentile over n_test samples)
+        """
+        test = self.p[np.linspace(0, self.p.shape[0]-1, min(n_test, self.p.shape[0])).astype(int)]
+        if self.tree is not None:
+            d = self.tree.query(test, 2)[0][:,1]
+        else:
+            d2 = np.sum((test[:,None,:] - self.p[None,:,:])**2, axis=2)
+            d = np.sqrt(np.partition(d2, 1, axis=1)[:,1])
+        return np.percentile(d, 99)
+
+    @classmethod
+    def build(cls, robot, n_samples=20000, seed=None, n_workers=None, **kwargs):
+        """
+        @info: samples joint configurations inside the joint limits (joints without limits 
+               in [-pi, pi]) and computes their forward kinematics in a pool of processes
+        @inputs:
+        -------
+            - robot: Robot object
+            - n_samples: number of samples
+            - seed: seed of the random generator (optional)
+            - n_workers: number of processes (optional, default: number of cores)
+        """
+        model = robot.robot.model
+        lower = np.array(model.lowerPositionLimit)
+        upper = np.array(model.upperPositionLimit)
+        unlimited = ~(np.isfinite(lower) & np.isfinite(upper) & (lower < upper))
+        lower[unlimited] = -np.pi
+        upper[unlimited] = np.pi
+        q = np.random.default_rng(seed).uniform(lower, upper, size=(n_samples, robot.ndof))
+        results = run_blocks(_fk_block, n_samples, n_workers, (model, robot.frame_ee, q))
+        p = np.concatenate([p for p, _ in results], axis=0)
+        R = np.concatenate([R for _, R in results], axis=0)
+        return cls(q, p, R, **kwargs)
+
+    def save(self, path):
+        np.savez(path, q=self.q, p=self.p, R=self.R, reach_tol=self.reach_tol, 
+                 orientation_weight=self.orientation_weight)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        return cls(data['q'], data['p'], data['R'], float(data['reach_tol']), float(data['orientation_weight']))
+
+    def nearest(self, x_des, R_des=None, k=64):
+        """
+        @info: nearest sample of a target. With R_des, the k nearest samples in position are
+               compared with the cost: distance + orientation_weight*angle(R^T R_des)
+        @outputs:
+        --------
+            - i: index of the sample
+            - d: position distance to the target [m]
+        """
+        x_des = np.asarray(x_des, dtype=float)[0:3]
+        k = 1 if R_des is None else min(k, self.p.shape[0])
+        if self.tree is not None:
+            d, idx = self.tree.query(x_des, k)
+        else:
+            d2 = np.sum((self.p - x_des)**2, axis=1)
+            idx = np.argpartition(d2, k-1)[:k] if k < d2.shape[0] else np.arange(d2.shape[0])
+            d = np.sqrt(d2[idx])
+        d, idx = np.atleast_1d(d), np.atleast_1d(idx)
+        if R_des is None:
+            j = np.argmin(d)
+        else:
+            cos_angle = 0.5*(np.einsum('nji,jk->nik', self.R[idx], R_des).trace(axis1=1, axis2=2) - 1)
+            cost = d + self.orientation_weight*np.arccos(np.clip(cos_angle, -1.0, 1.0))
+            j = np.argmin(cost)
+        return idx[j], d[j]
+
+    def seed(self, x_des, R_des=None):
+        """
+        @info: joint configuration of the nearest sample (IK seed)
+        """
+        return copy(self.q[self.nearest(x_des, R_des)[0]])
+
+    def reachable(self, x_des):
+        """
+        @info: False if the target is farther than reach_tol from every sample
+        """
+        return self.nearest(x_des)[1] <= self.reach_tol
+
+class RolloutLog(object):
+    """
+    @info: signals of a simulation rollout, stored as contiguous arrays (one row per sample).
+           The signals are read as attributes (log.q) or items (log['q']).
+
+    @inputs:
+    -------
+        - t: time of each sample [T]
+        - channels: arrays of the signals [T x ...]
+
+    @methods:
+        - save(path)
+        - load(path)
+    """
+    def __init__(self, t, **channels):
+        self.t = t
+        self.channels = list(channels)
+        for name, values in channels.items():
+            setattr(self, name, values)
+
+    def __getitem__(self, name):
+        return getattr(self, name)
+
+    def __len__(self):
+        return len(self.t)
+
+    def save(self, path):
+        np.savez(path, t=self.t, **{name: getattr(self, name) for name in self.channels})
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        return cls(data['t'], **{name: data[name] for name in data.files if name != 't'})
+
 class Robot(object):
     """
     @info: Class to load the .urdf of a robot. For thism Pinocchio library is used
@@ -441,8 +1476,18 @@ class Robot(object):
         - send_control_command(u)
         - inverse_kinematics_position(x_des, q0)
         - inverse_kinematics_pose(x_des, R_des, q0)
+        - inverse_kinematics_batch(x_des, q0, R_des)
+        - inverse_kinematics_trajectory(x_des, q0, R_des)
+        - rollout(controller, duration, channels)
+
+    @info: the forward dynamics method ('aba', 'cholesky' or 'inverse') is selected 
+           with "dynamics". The inertia matrix (M), nonlinear effects (b) and gravity
+           effects (g) are computed at the current state only when they are needed.
+           The kinematic passes are shared through a KinematicsCache (self.kinematics).
+           The end-effector states (p, R, dp, w, ddp, dw) are also computed on demand, 
+           so a joint space controller only pays for the integration.
     """    
-    def __init__(self, q0, dq0, dt, urdf_path):
+    def __init__(self, q0, dq0, dt, urdf_path, dynamics='aba'):
         # robot object
         self.robot = pin.robot_wrapper.RobotWrapper.BuildFromURDF(urdf_path)
         # degrees of freedom
@@ -451,37 +1496,125 @@ class Robot(object):
         self.q = copy(q0)                
         self.dq = copy(dq0)               
         self.ddq = np.zeros(self.ndof)
-        # inertia matrix
-        self.M = np.zeros([self.ndof, self.ndof])
-        # nonlinear effects vector
-        self.b = np.zeros(self.ndof)
-        # gravivty effects vector
-        self.g = np.zeros(self.ndof)
+        # forward dynamics method
+        self.dynamics = dynamics
+        # dynamic model (M, b, g) computed at the state (q, dq) 
+        self._dyn = dict()
+        self._dyn_key = None
         # vector of zeros
         self.z = np.zeros(self.ndof)
         # sampling time
         self.dt = copy(dt)     
         # frame id: end-effector
         self.frame_ee = self.robot.model.getFrameId('ee_link') 
-        # end-effector: position, velocity and acceleration
-        self.p = np.zeros(3)
-        self.dp = np.zeros(3)
-        self.ddp = np.zeros(3)
-        # end-effector: orientation
-        self.R = np.zeros([3,3])
-        # end-effector: angular velocity and acceleration
-        self.w = np.zeros(3)
-        self.dw = np.zeros(3)
-        # initial configuration: position (p) and orientation (R)
-        self.p, self.R = self.forward_kinematics(self.q)
-        # initial configuration: linear (dp) and angular (w) velocity
-        self.dp, self.w = self.twist(self.q, self.dq)
-        # initial configuration: linear (ddp) and angular (dw) acceleration
-        self.ddp, self.dw = self.dtwist(self.q, self.dq, self.ddq)
-        # initial configuration: dynamic model
-        self.M = pin.crba(self.robot.model, self.robot.data, self.q)
-        self.b = pin.rnea(self.robot.model, self.robot.data, self.q, self.dq, self.z)
-        self.g = pin.rnea(self.robot.model, self.robot.data, self.q, self.z, self.z)        
+        # kinematic passes of the end-effector: position, orientation, velocity and acceleration
+        self.kinematics = KinematicsCache(self.robot.model, self.robot.data, self.frame_ee)
+        # inverse kinematics solver (iterations and error of the last solve)
+        self.ik = IKSolver(self.kinematics)
+        # workspace samples to seed the inverse kinematics (optional, see WorkspaceIndex)
+        self.workspace = None
+
+    def _dynamics_memo(self):
+        """
+        @info: returns the dynamic terms (and end-effector twists) already computed at the 
+               current state (q, dq). They are discarded when the state changes.
+        """
+        key = np.asarray(self.q, dtype=float).tobytes() + np.asarray(self.dq, dtype=float).tobytes()
+        if key != self._dyn_key:
+            self._dyn = dict()
+            self._dyn_key = key
+        return self._dyn
+
+    @property
+    def p(self):
+        """
+        @info: end-effector position at the current state
+        """
+        return self.forward_kinematics(self.q)[0]
+
+    @property
+    def R(self):
+        """
+        @info: end-effector orientation at the current state
+        """
+        return self.forward_kinematics(self.q)[1]
+
+    def _ee_twist(self, order):
+        """
+        @info: end-effector velocity (order=1) or acceleration (order=2) at the current state.
+               Both are usually read together, so a single pass computes both of them.
+               The results are kept with the dynamic terms of the current state.
+        """
+        dyn = self._dynamics_memo()
+        if order == 1:
+            if 'twist' not in dyn:
+                self.kinematics.update(self.q, self.dq, KinematicsCache.JACOBIAN_DOT)
+                dyn['twist'] = self.twist(self.q, self.dq)
+            return dyn['twist']
+        # the acceleration also depends on ddq
+        ddq_key = np.asarray(self.ddq, dtype=float).tobytes()
+        if dyn.get('dtwist_ddq') != ddq_key:
+            dyn['dtwist'] = self.dtwist(self.q, self.dq, self.ddq)
+            dyn['dtwist_ddq'] = ddq_key
+        return dyn['dtwist']
+
+    @property
+    def dp(self):
+        """
+        @info: end-effector linear velocity at the current state
+        """
+        return self._ee_twist(1)[0]
+
+    @property
+    def w(self):
+        """
+        @info: end-effector angular velocity at the current state
+        """
+        return self._ee_twist(1)[1]
+
+    @property
+    def ddp(self):
+        """
+        @info: end-effector linear acceleration at the current state
+        """
+        return self._ee_twist(2)[0]
+
+    @property
+    def dw(self):
+        """
+        @info: end-effector angular acceleration at the current state
+        """
+        return self._ee_twist(2)[1]
+
+    @property
+    def M(self):
+        """
+        @info: inertia matrix at the current state
+        """
+        dyn = self._dynamics_memo()
+        if 'M' not in dyn:
+            dyn['M'] = pin.crba(self.robot.model, self.robot.data, self.q)
+        return dyn['M']
+
+    @property
+    def b(self):
+        """
+        @info: nonlinear effects vector at the current state
+        """
+        dyn = self._dynamics_memo()
+        if 'b' not in dyn:
+            dyn['b'] = pin.nonLinearEffects(self.robot.model, self.robot.data, self.q, self.dq)
+        return dyn['b']
+
+    @property
+    def g(self):
+        """
+        @info: gravity effects vector at the current state
+        """
+        dyn = self._dynamics_memo()
+        if 'g' not in dyn:
+            dyn['g'] = pin.computeGeneralizedGravity(self.robot.model, self.robot.data, self.q)
+        return dyn['g']
   
     def forward_kinematics(self, q0):
         """
@@ -496,12 +1629,10 @@ class Robot(object):
             - p: position of the end-effector (m).
             - R: rotation matrix of the end-effector (rad).
         """      
-        # commpute forward kinematics
-        pin.forwardKinematics(self.robot.model, self.robot.data, q0) 
+        # commpute forward kinematics (once per configuration)
+        kin = self.kinematics.update(q0)
         # get position and orientation       
-        p = pin.updateFramePlacement(self.robot.model, self.robot.data, self.frame_ee).translation
-        R = pin.updateFramePlacement(self.robot.model, self.robot.data, self.frame_ee).rotation
-        return p, R
+        return copy(kin.p), copy(kin.R)
 
     def analityc_jacobian(self, q0):
         """
@@ -521,9 +1652,8 @@ class Robot(object):
         -------
             - J: geometric jacobian matrix            
         """
-        pin.computeJointJacobians(self.robot.model, self.robot.data, q0)
-        J = pin.getFrameJacobian(self.robot.model, self.robot.data, self.frame_ee, pin.ReferenceFrame.LOCAL_WORLD_ALIGNED)
-        return J
+        kin = self.kinematics.update(q0, level=KinematicsCache.JACOBIAN)
+        return copy(kin.J)
     
     def geometric_jacobian_time_derivative(self, q0, dq0):
         """
@@ -538,9 +1668,8 @@ class Robot(object):
             - dJ: time derivative of jacobian matrix            
         """        
         # compute time-derivative of jacobian matrix (end-effector frame)
-        pin.computeJointJacobiansTimeVariation(self.robot.model, self.robot.data, q0, dq0)
-        dJ = pin.getFrameJacobianTimeVariation(self.robot.model, self.robot.data, self.frame_ee, pin.ReferenceFrame.LOCAL_WORLD_ALIGNED)
-        return dJ
+        kin = self.kinematics.update(q0, dq0, KinematicsCache.JACOBIAN_DOT)
+        return copy(kin.dJ)
     
     def twist(self, q0, dq0):
         """
@@ -554,7 +1683,7 @@ class Robot(object):
             - v: linear velocity (m/s)
             - w: angular velocity (rad/s)             
         """
-        J = self.geometric_jacobian(q0)
+        J = self.kinematics.update(q0, level=KinematicsCache.JACOBIAN).J
         v = J[0:3,0:6].dot(dq0)
         w = J[3:6,0:6].dot(dq0)
         return v, w
@@ -572,8 +1701,8 @@ class Robot(object):
             - a: linear acceleration (m/s^2)
             - dw: angular acceleration (rad/s^2)             
         """      
-        J = self.geometric_jacobian(q0)
-        dJ = self.geometric_jacobian_time_derivative(q0, dq0)
+        kin = self.kinematics.update(q0, dq0, KinematicsCache.JACOBIAN_DOT)
+        J, dJ = kin.J, kin.dJ
         a = dJ[0:3,0:6].dot(dq0) + J[0:3,0:6].dot(ddq0)
         dw = dJ[3:6,0:6].dot(dq0) + J[3:6,0:6].dot(ddq0)
         return a, dw
@@ -581,99 +1710,250 @@ class Robot(object):
     def send_control_command(self, u):
         """
         @info: uses the control signal (u) to compute forward dynamics (ddq). 
-              Then update joint configuration (q) and end-effector pose (p, R)
+              Then update joint configuration (q). The end-effector states (p, R, ...)
+              are computed when they are read.
         """
         tau = np.squeeze(np.asarray(u))
-        # compute dynamics model
-        self.M = pin.crba(self.robot.model, self.robot.data, self.q)
-        self.b = pin.rnea(self.robot.model, self.robot.data, self.q, self.dq, self.z)
-        self.g = pin.rnea(self.robot.model, self.robot.data, self.q, self.z, self.z)
-        # forward dynamics
-        self.ddq = np.linalg.inv(self.M).dot(tau-self.b)
+        # forward dynamics: reuses M and b if they were already computed at this state
+        dyn = self._dynamics_memo()
+        self.ddq, M, b = forward_dynamics(self.robot.model, self.robot.data, self.q, self.dq, tau, 
+                                          self.dynamics, dyn.get('M'), dyn.get('b'))
+        if M is not None:
+            dyn['M'] = M
+        if b is not None:
+            dyn['b'] = b
         # update joint position/configuration
         self.dq = self.dq + self.dt*self.ddq
         self.q = self.q + self.dt*self.dq + 0.5*self.dt*self.dt*self.ddq
-        # update end-effector: linear and angular position, velocity and acceleration
-        self.p, self.R = self.forward_kinematics(self.q)
-        self.dp, self.w = self.twist(self.q, self.dq)
-        self.ddp, self.dw = self.dtwist(self.q, self.dq, self.ddq)
                 
-    def inverse_kinematics_position(self, x_des, q0):
+    def inverse_kinematics_position(self, x_des, q0=None, max_iter=10):
         """
         @info: computes joint position (q) from cartesian position (xyz) using 
-               the method of damped pseudo-inverse.
+               the method of damped pseudo-inverse (see IKSolver).
         @inputs:
         -------
             - xdes  :   desired position vector
-            - q0    :   initial joint configuration (it's very important)
+            - q0    :   initial joint configuration (it's very important). If None,
+                        the nearest sample of self.workspace is used
         @outputs:
         --------        
-            - q_best  : joint position
+            - q_best  : joint position (self.ik.converged, self.ik.error and 
+                        self.ik.iterations describe the solve)
         """         
-        best_norm_e     = 1e-6 
-        max_iter        = 10
-        delta           = 1
-        lambda_         = 0.0000001
-        q               = copy(q0)
+        return self._solve_ik(x_des, None, q0, max_iter)
 
-        for i in range(max_iter):
-            p, _ = self.forward_kinematics(q) # current position
-            e   = x_des - p      # position error
-            J   = self.geometric_jacobian(q)[0:3, 0:self.ndof] # position jacobian [3x6]
-            J_damped_inv =  damped_pinv(J, lambda_) # inverse jacobian [6x3]
-            dq  = np.dot(J_damped_inv, e)
-            q   = q + delta*dq
-                       
-            # evaluate convergence criterion
-            if (np.linalg.norm(e)<best_norm_e):
-                best_norm_e = np.linalg.norm(e)
-                q_best = copy(q) 
-        return q_best 
-
-    def inverse_kinematics_pose(self, x_des, R_des, q0, max_iter=10):
+    def inverse_kinematics_pose(self, x_des, R_des, q0=None, max_iter=10):
         """
         @info: computes joint position (q) from cartesian position (xyz) and orientation(axis/angle) 
-               using the method of damped pseudo-inverse.
+               using the method of damped pseudo-inverse (see IKSolver).
         @inputs:
         -------
             - x_des: desired cartesian position
             - R_des: desired rotation matrix
-            - q0: initial joint configuration (it's very important)
+            - q0: initial joint configuration (it's very important). If None, 
+                  the nearest sample of self.workspace is used
         @outputs:
         --------        
-            - q_best  : joint position
+            - q_best  : joint position (self.ik.converged, self.ik.error and 
+                        self.ik.iterations describe the solve)
         """         
-        best_norm_e     = 1e-6 
-        delta           = 1
-        lambda_         = 0.0000001
-        q               = copy(q0)
+        return self._solve_ik(x_des, R_des, q0, max_iter)
+
+    def _solve_ik(self, x_des, R_des, q0, max_iter):
+        if q0 is not None:
+            return self.ik.solve(x_des, q0, R_des, max_iter)
+        if self.workspace is None:
+            raise ValueError("q0 is required when the robot has no workspace index")
+        q0 = self.workspace.seed(x_des, R_des)
+        if not self.workspace.reachable(x_des):
+            # unreachable target: no iterations
+            return self.ik.solve(x_des, q0, R_des, max_iter=0)
+        return self.ik.solve(x_des, q0, R_des, max_iter)
+
+    def inverse_kinematics_batch(self, x_des, q0=None, R_des=None, max_iter=10, tol=1e-6, n_workers=None):
+        """
+        @info: computes joint positions (q) of many cartesian targets. The targets are solved
+               in blocks by a pool of processes (the state of the robot is not modified).
+        @inputs:
+        -------
+            - x_des: desired cartesian positions [N x 3] (or [3] for a single target)
+            - q0: initial joint configurations [N x ndof] (or [ndof] for all the targets).
+                  If None, the nearest samples of self.workspace are used
+            - R_des: desired rotation matrices [N x 3 x 3] (or [3 x 3] for a single target)
+                     (optional, only position if None)
+            - max_iter: iterations of each solve
+            - tol: maximum error norm of a converged target
+            - n_workers: number of processes (optional, default: number of cores)
+        @outputs:
+        --------
+            - q: joint positions [N x ndof]
+            - converged: True if the error norm is below tol [N]
+            - residual: error norm at q [N]
+        """
+        x_des = np.array(x_des, dtype=float, ndmin=2)
+        if x_des.ndim != 2 or x_des.shape[1] != 3:
+            raise ValueError("x_des must be cartesian positions [N x 3], not {}: the orientation of "
+                             "poses [N x 6] is given with R_des".format(np.shape(x_des)))
+        n = x_des.shape[0]
+        if R_des is not None:
+            R_des = np.asarray(R_des, dtype=float)
+            if R_des.shape[-2:] != (3, 3) or R_des.reshape(-1, 3, 3).shape[0] != n:
+                raise ValueError("R_des must be rotation matrices [N x 3 x 3] (or [3 x 3] for a single "
+                                 "target) with N = {} targets, not {}".format(n, R_des.shape))
+            R_des = R_des.reshape(-1, 3, 3)
+        if q0 is None:
+            if self.workspace is None:
+                raise ValueError("q0 is required when the robot has no workspace index")
+            q0 = [self.workspace.seed(x_des[i], None if R_des is None else R_des[i]) for i in range(n)]
+        q0 = np.broadcast_to(np.asarray(q0, dtype=float).reshape(-1, self.ndof), (n, self.ndof))
+        if n == 0:
+            return np.zeros((0, self.ndof)), np.zeros(0, dtype=bool), np.zeros(0)
+        results = run_blocks(_ik_block, n, n_workers, (self.robot.model, self.frame_ee, 
+                             self._ik_settings(max_iter, tol), x_des, q0, R_des))
+        q = np.concatenate([q for q, _ in results], axis=0)
+        residual = np.concatenate([residual for _, residual in results], axis=0)
+        return q, residual < tol, residual
+
+    def _ik_settings(self, max_iter, tol=None):
+        """
+        @info: arguments of IKSolver (after kin) with the settings of self.ik
+        """
+        tol = self.ik.tol if tol is None else tol
+        return (max_iter, tol, self.ik.lambda_, self.ik.lambda_max, self.ik.line_search, self.ik.clamp)
 
-        for i in range(max_iter):
-            p, R = self.forward_kinematics(q) # current position
-            # error: position (xyz)
-            e_p = x_des[0:3] - p                  
-            # error: orientation axis/angle
-            e_o = axisangle_error(R_des, R)
-            # error: position and orientation
-            e = np.concatenate((e_p,e_o), axis=0) # [6x1] 
-            # jacobian
-            J   = self.geometric_jacobian(q) # [6x6]
-            # jacobian: pseudo-inverse
-            J_damped_inv = damped_pinv(J, lambda_) # [6x6]
-            dq  = np.dot(J_damped_inv, e)
-            q   = q + delta*dq
-            #print("e_o: ", e_o)                       
-            # evaluate convergence criterion
-            if (np.linalg.norm(e)<best_norm_e):
-                best_norm_e = np.linalg.norm(e)
-                q_best = copy(q) 
-        return q
+    def _new_ik_solver(self, max_iter, tol=None):
+        """
+        @info: IKSolver with the settings of self.ik and its own pinocchio data
+        """
+        kin = KinematicsCache(self.robot.model, self.robot.model.createData(), self.frame_ee)
+        return IKSolver(kin, *self._ik_settings(max_iter, tol))
+
+    def inverse_kinematics_trajectory(self, x_des, q0, R_des=None, dt=None, chunk_size=500, max_iter=10, 
+                                      seam_tol=0.5, n_workers=None):
+        """
+        @info: computes the joint trajectory of a cartesian trajectory. Each sample is warm-started
+               from the solution of the previous one. Long trajectories are split in chunks that are
+               solved by a pool of processes: the first sample of each chunk is warm-started from the first 
+               sample of the previous chunk, and a chunk is solved again from the end of the previous
+               one if they do not join (joint jump above seam_tol, e.g. another IK branch).
+        @inputs:
+        -------
+            - x_des: cartesian trajectory: poses [N x 6] (xyz, rpy) as DataReader.xs or positions [N x 3]
+            - q0: initial joint configuration
+            - R_des: desired rotation matrices [N x 3 x 3] (optional, with positions [N x 3])
+            - dt: sampling time of the trajectory (optional, default: self.dt)
+            - chunk_size: number of samples of each chunk
+            - max_iter: iterations of each sample (10x for the first sample of each chunk)
+            - seam_tol: maximum joint jump between two chunks [rad]
+            - n_workers: number of processes (optional, default: number of cores)
+        @outputs:
+        --------
+            - q, dq, ddq: joint position, velocity and acceleration [N x ndof]
+            - residual: error norm of each sample [N]
+        """
+        x_des = np.asarray(x_des, dtype=float)
+        if x_des.shape[1] == 6 and R_des is None:
+            R_des = rpy2rot_batch(x_des[:,3:6])
+        x_des = x_des[:,0:3]
+        dt = self.dt if dt is None else dt
+        n = x_des.shape[0]
+        q = np.zeros((n, self.ndof))
+        residual = np.zeros(n)
+        starts = np.arange(0, n, chunk_size)
+        bounds = [(start, min(start + chunk_size, n)) for start in starts]
+
+        # first sample of each chunk (sequential)
+        ik = self._new_ik_solver(max_iter)
+        seeds = []
+        seed = np.array(q0, dtype=float)
+        for start in starts:
+            seed = ik.solve(x_des[start], seed, None if R_des is None else R_des[start], 10*max_iter)
+            seeds.append(seed)
+
+        # chunks (pool of processes)
+        results = run_blocks(_ik_chunk_block, len(starts), n_workers, (self.robot.model, self.frame_ee,
+                             self._ik_settings(max_iter), bounds, seeds, x_des, R_des))
+        for k, (q_chunk, residual_chunk) in enumerate(chunk for block in results for chunk in block):
+            start, stop = bounds[k]
+            q[start:stop], residual[start:stop] = q_chunk, residual_chunk
+
+        # seams between chunks (sequential)
+        for k in range(1, len(starts)):
+            start, stop = bounds[k]
+            if np.max(np.abs(q[start] - q[start-1])) > seam_tol:
+                q[start:stop], residual[start:stop] = _ik_chunk(ik, x_des, R_des, start, stop, q[start-1])
+
+        # joint velocity and acceleration
+        if n > 1:
+            dq = np.gradient(q, dt, axis=0)
+            ddq = np.gradient(dq, dt, axis=0)
+        else:
+            dq = np.zeros_like(q)
+            ddq = np.zeros_like(q)
+        return q, dq, ddq, residual
+
+    def rollout(self, controller, duration, channels=('q', 'dq', 'ddq', 'tau'), t0=0.0):
+        """
+        @info: simulates the robot for "duration" seconds. In each sample the controller computes
+               the control signal, it is sent to the robot and the requested channels are written
+               in preallocated arrays (no lists, no per-sample copies).
+        @inputs:
+        -------
+            - controller: function controller(t, robot) that returns the control signal (tau)
+            - duration: simulation time [sec]
+            - channels: signals to store: 'q', 'dq', 'ddq', 'tau', 'p', 'R', 'dp', 'w', 
+                        'ddp', 'dw', 'M', 'b', 'g'
+            - t0: initial time [sec]
+        @outputs:
+        --------
+            - log: RolloutLog with the time (after each sample) and the channels [T x ...]
+        """
+        n = int(round(duration/self.dt))
+        shapes = {'q': (self.ndof,), 'dq': (self.ndof,), 'ddq': (self.ndof,), 'tau': (self.ndof,),
+                  'p': (3,), 'R': (3,3), 'dp': (3,), 'w': (3,), 'ddp': (3,), 'dw': (3,),
+                  'M': (self.ndof, self.ndof), 'b': (self.ndof,), 'g': (self.ndof,)}
+        for name in channels:
+            if name not in shapes:
+                raise ValueError("unknown channel: %s" % name)
+        log = {name: np.zeros((n,) + shapes[name]) for name in channels}
+        t = t0 + self.dt*np.arange(1, n+1)
+        # kinematic pass needed by the cartesian channels
+        level = 0
+        if any(name in channels for name in ('p', 'R')):
+            level = KinematicsCache.PLACEMENT
+        if any(name in channels for name in ('dp', 'w')):
+            level = KinematicsCache.JACOBIAN
+        if any(name in channels for name in ('ddp', 'dw')):
+            level = KinematicsCache.JACOBIAN_DOT
+        for k in range(n):
+            tau = np.squeeze(np.asarray(controller(t[k] - self.dt, self)))
+            self.send_control_command(tau)
+            if level:
+                kin = self.kinematics.update(self.q, self.dq, level)
+            for name, values in log.items():
+                if name == 'tau':
+                    values[k] = tau
+                elif name in ('q', 'dq', 'ddq'):
+                    values[k] = getattr(self, name)
+                elif name in ('p', 'R'):
+                    values[k] = getattr(kin, name)
+                elif name in ('dp', 'w'):
+                    rows = slice(0, 3) if name == 'dp' else slice(3, 6)
+                    np.dot(kin.J[rows], self.dq, out=values[k])
+                elif name in ('ddp', 'dw'):
+                    rows = slice(0, 3) if name == 'ddp' else slice(3, 6)
+                    np.dot(kin.dJ[rows], self.dq, out=values[k])
+                    values[k] += np.dot(kin.J[rows], self.ddq)
+                else:
+                    values[k] = getattr(self, name)
+        return RolloutLog(t, **log)
 
     def read_joint_position_velocity_acceleration(self):
         return self.q, self.dq, self.ddq
 
     def read_cartesian_position_velocity_acceleration(self):
-        return self.p, self.dp, self.ddp
+        ddp = self.ddp # the same pass gives the position and velocity
+        return self.p, self.dp, ddp
 
     def read_ee_position(self):
         return self.p
@@ -685,7 +1965,213 @@ class Robot(object):
         return self.w, self.dw
 
     def read_ee_linear_velocity(self):
-        return self.v        
+        return self.dp
+
+    def get_M(self):
+        return self.M
+
+    def get_b(self):
+        return self.b
+
+    def get_g(self):
+        return self.g
+
+class BatchedRobot(object):
+    """
+    @info: Class to simulate N copies of the same robot. The .urdf is parsed only once and the
+           forward dynamics of all the copies is computed in one call of pinocchio's parallel 
+           algorithms (abaInParallel, rneaInParallel), which run in the threads of pinocchio. 
+           Each copy also owns a pinocchio data for the terms without a parallel algorithm 
+           (kinematics, inertia matrix, 'cholesky' and 'inverse' methods).
+
+    @inputs:
+    -------
+        - q0: initial joint position of each copy [N x ndof]
+        - dq0: initial joint velocity of each copy [N x ndof]
+        - dt: sampling time
+        - urdf_path: path of the .urdf file
+        - n_workers: number of threads of pinocchio (optional, default: number of cores)
+        - dynamics: forward dynamics method, 'aba', 'cholesky' or 'inverse' (optional)
+
+    @methods:
+        - send_control_command(u)
+        - close()
+    """
+    def __init__(self, q0, dq0, dt, urdf_path, n_workers=None, dynamics='aba'):
+        # robot object: the model is shared by all copies
+        self.robot = pin.robot_wrapper.RobotWrapper.BuildFromURDF(urdf_path)
+        self.model = self.robot.model
+        # degrees of freedom
+        self.ndof = self.model.nq
+        # joint configuration of each copy: position, velocity and acceleration [N x ndof]
+        self.q = np.array(q0, dtype=float, ndmin=2)
+        self.dq = np.array(dq0, dtype=float, ndmin=2)
+        self.ddq = np.zeros_like(self.q)
+        # number of copies
+        self.n_robots = self.q.shape[0]
+        # pinocchio data: one per copy
+        self.datas = [self.model.createData() for i in range(self.n_robots)]
+        # threads of pinocchio: one model/data of the pool per thread
+        if n_workers is None:
+            n_workers = os.cpu_count() or 1
+        self.n_workers = max(1, min(n_workers, self.n_robots))
+        self.pool = None
+        # forward dynamics method
+        self.dynamics = dynamics
+        # dynamic model of each copy: inertia matrix, nonlinear and gravity effects.
+        # They are computed only when requested ("_dyn_valid": terms of the current states)
+        self._M = None
+        self._b = None
+        self._g = None
+        self._dyn_valid = set()
+        # sampling time
+        self.dt = copy(dt)
+        # frame id: end-effector
+        self.frame_ee = self.model.getFrameId('ee_link')
+        # end-effector of each copy: position, orientation, velocity and acceleration.
+        # They are computed only when they are read ("_kin_valid": states of the current step).
+        # As in Robot, each step gives new arrays of the states (the arrays that were read 
+        # before are not modified)
+        self._kin_valid = False
+
+    def _model_pool(self):
+        if self.pool is None:
+            self.pool = pin.ModelPool(self.model, self.n_workers)
+        return self.pool
+
+    def _dynamics_term(self, name):
+        if name not in self._dyn_valid:
+            if name == 'M':
+                self._M = np.array([pin.crba(self.model, self.datas[i], self.q[i]) for i in range(self.n_robots)])
+            elif name == 'b':
+                # rnea(q, dq, 0): columns are the copies
+                self._b = np.ascontiguousarray(pin.rneaInParallel(self.n_workers, self._model_pool(), self.q.T, 
+                                               self.dq.T, np.zeros((self.ndof, self.n_robots))).T)
+            else:
+                # rnea(q, 0, 0)
+                zeros = np.zeros((self.ndof, self.n_robots))
+                self._g = np.ascontiguousarray(pin.rneaInParallel(self.n_workers, self._model_pool(), self.q.T, 
+                                               zeros, zeros).T)
+            self._dyn_valid.add(name)
+        return getattr(self, '_'+name)
+
+    @property
+    def M(self):
+        return self._dynamics_term('M')
+
+    @property
+    def b(self):
+        return self._dynamics_term('b')
+
+    @property
+    def g(self):
+        return self._dynamics_term('g')
+
+    def _update_kinematics(self):
+        """
+        @info: computes the end-effector states of all the copies at the current states
+        """
+        if self._kin_valid:
+            return
+        self._p = np.zeros([self.n_robots, 3])
+        self._R = np.zeros([self.n_robots, 3, 3])
+        self._dp = np.zeros([self.n_robots, 3])
+        self._w = np.zeros([self.n_robots, 3])
+        self._ddp = np.zeros([self.n_robots, 3])
+        self._dw = np.zeros([self.n_robots, 3])
+        for i in range(self.n_robots):
+            data = self.datas[i]
+            # one pass: placement, jacobian and its time-derivative
+            pin.computeJointJacobiansTimeVariation(self.model, data, self.q[i], self.dq[i])
+            placement = pin.updateFramePlacement(self.model, data, self.frame_ee)
+            J = pin.getFrameJacobian(self.model, data, self.frame_ee, pin.ReferenceFrame.LOCAL_WORLD_ALIGNED)
+            dJ = pin.getFrameJacobianTimeVariation(self.model, data, self.frame_ee, pin.ReferenceFrame.LOCAL_WORLD_ALIGNED)
+            self._p[i] = placement.translation
+            self._R[i] = placement.rotation
+            # twist and its time-derivative
+            v = J.dot(self.dq[i])
+            a = dJ.dot(self.dq[i]) + J.dot(self.ddq[i])
+            self._dp[i], self._w[i] = v[0:3], v[3:6]
+            self._ddp[i], self._dw[i] = a[0:3], a[3:6]
+        self._kin_valid = True
+
+    def _kinematics_term(self, name):
+        self._update_kinematics()
+        return getattr(self, '_'+name)
+
+    @property
+    def p(self):
+        return self._kinematics_term('p')
+
+    @property
+    def R(self):
+        return self._kinematics_term('R')
+
+    @property
+    def dp(self):
+        return self._kinematics_term('dp')
+
+    @property
+    def w(self):
+        return self._kinematics_term('w')
+
+    @property
+    def ddp(self):
+        return self._kinematics_term('ddp')
+
+    @property
+    def dw(self):
+        return self._kinematics_term('dw')
+
+    def send_control_command(self, u):
+        """
+        @info: uses the control signal of each copy (u) [N x ndof] to compute forward dynamics (ddq).
+               Then update joint configuration (q) of all copies (the end-effector pose is computed
+               when it is read).
+        """
+        tau = np.ascontiguousarray(np.broadcast_to(np.asarray(u, dtype=float), self.q.shape))
+        ddq = np.zeros_like(self.q)
+        if self.dynamics == 'aba':
+            # forward dynamics of all the copies in the threads of pinocchio (columns: copies)
+            pin.abaInParallel(self.n_workers, self._model_pool(), self.q.T, self.dq.T, tau.T, ddq.T)
+        else:
+            # reuse M and b if they were requested at the current states
+            M = self._M if 'M' in self._dyn_valid else None
+            b = self._b if 'b' in self._dyn_valid else None
+            for i in range(self.n_robots):
+                ddq[i], _, _ = forward_dynamics(self.model, self.datas[i], self.q[i], self.dq[i], tau[i], 
+                                                self.dynamics, None if M is None else M[i], 
+                                                None if b is None else b[i])
+        # update joint position/configuration (new arrays: the states read before are kept)
+        self.ddq = ddq
+        self.dq = self.dq + self.dt*self.ddq
+        self.q = self.q + self.dt*self.dq + 0.5*self.dt*self.dt*self.ddq
+        self._dyn_valid = set()
+        self._kin_valid = False
+
+    def close(self):
+        """
+        @info: releases the model/data pool of pinocchio (it is created again if needed)
+        """
+        self.pool = None
+
+    def read_joint_position_velocity_acceleration(self):
+        return self.q, self.dq, self.ddq
+
+    def read_cartesian_position_velocity_acceleration(self):
+        return self.p, self.dp, self.ddp
+
+    def read_ee_position(self):
+        return self.p
+
+    def read_ee_orientation(self):
+        return self.R
+
+    def read_ee_angular_velocity_acceleration(self):
+        return self.w, self.dw
+
+    def read_ee_linear_velocity(self):
+        return self.dp
 
     def get_M(self):
         return self.M
@@ -698,7 +2184,10 @@ class Robot(object):
 
 class MultipleKalmanDerivator:
     """
-    @info creates a kalman filter for each degree of freedom
+    @info creates a kalman filter for each degree of freedom. All the filters have the same model
+          (F, H, Q, R) and initial covariance, so they also have the same covariance and gain:
+          these are computed once per sample and the states of all the degrees of freedom 
+          [n_dof x 3] are updated at once.
     @inputs:
     -------
         - deltaT: samping time
@@ -706,32 +2195,53 @@ class MultipleKalmanDerivator:
         - x0, dx0, ddx0: initial states [n_dof,]
         - sigmaR: covariance matrix that indicates model uncertainty / motion noise
         - sigmaQ: covariance matrix that indicates measurement noise  
+        - steady_state, transient: steady-state gain mode (see KalmanDerivator)
     """
-    def __init__(self, deltaT, x0, dx0, ddx0, n_obs=2, sigmaR = 1e-3, sigmaQ = 1):
+    def __init__(self, deltaT, x0, dx0, ddx0, n_obs=2, sigmaR = 1e-3, sigmaQ = 1, steady_state=False, transient=0):
         # initial conditions
-        self.q = copy(x0)
-        self.dq = copy(dx0)
-        self.ddq = copy(ddx0)
+        self.q = np.array(x0, dtype=float)
+        self.dq = np.array(dx0, dtype=float)
+        self.ddq = np.array(ddx0, dtype=float)
         self.n_dof = len(self.q)
         # samping time
         self.deltaT = deltaT
-        # list to store KalmanDerivator objects 
-        self.derivators = []
-        # create and initialiZe KalmanDerivator objects 
-        for i in range(self.n_dof):
-            x0 = np.array([self.q[i], self.dq[i], self.ddq[i]])
-            self.derivators.append(KalmanDerivator(x0, n_obs, self.deltaT, sigmaR, sigmaQ))
+        # kalman filter: model, covariance and gain shared by all the degrees of freedom
+        self.filter = KalmanDerivator(np.zeros(3), n_obs, self.deltaT, sigmaR, sigmaQ, steady_state, transient)
+        # states of each degree of freedom [n_dof x 3]
+        self.x_est = np.stack((self.q, self.dq, self.ddq), axis=1)
+        # measurements of each degree of freedom [n_dof x n_obs]
+        self.z = np.zeros((self.n_dof, n_obs))
                 
     def update(self, qr, dqr):
-        # update the kalman filter for each degree of freedom
-        for i in range(self.n_dof):
-            q, dq, ddq = self.derivators[i].run_kalman_filter(qr[i], dqr[i])
-            self.q[i] = q
-            self.dq[i] = dq
-            self.ddq[i] = ddq
+        kf = self.filter
+        # measurements
+        self.z[:,0] = qr
+        self.z[:,1] = dqr
+        # prediction stage
+        x_hat = mx(self.x_est, tr(kf.F))
+        # kalman gain
+        K = kf.update_gain()
+        # observation-correction stage of all the degrees of freedom
+        self.x_est = x_hat + mx(self.z - mx(x_hat, tr(kf.H)), tr(K))
+        self.q[:] = self.x_est[:,0]
+        self.dq[:] = self.x_est[:,1]
+        self.ddq[:] = self.x_est[:,2]
         # return filtered signal
         return self.q, self.dq, self.ddq
 
+    def smooth(self, q, dq=None):
+        """
+        @info offline smoothing of a whole recording from the current states 
+              (see KalmanDerivator.smooth)
+        @inputs:
+        -------
+            - q, dq: measured position and velocity [N x n_dof]
+        @outputs:
+        -------
+            - x, dx, ddx: smoothed position, velocity and acceleration [N x n_dof]
+        """
+        return self.filter.smooth(q, dq, self.x_est)
+
 class KalmanDerivator:
     """
     @info implement the kalman filter algorithm of the book "Probabilistic Robotics (Thrun 2000, pg. 36)" 
@@ -742,8 +2252,12 @@ class KalmanDerivator:
         - deltaT: samping time
         - sigmaR: covariance matrix that indicates model uncertainty / motion noise
         - sigmaQ: covariance matrix that indicates measurement noise  
+        - steady_state: True to use the steady-state kalman gain (F, H, Q and R are constant),
+                        so each sample only needs the fixed-gain prediction and correction
+        - transient: number of initial samples that use the exact covariance recursion
+                     before switching to the steady-state gain
     """
-    def __init__(self, x_est0, n_obs, deltaT, sigmaR = 1e-3, sigmaQ = 1):
+    def __init__(self, x_est0, n_obs, deltaT, sigmaR = 1e-3, sigmaQ = 1, steady_state=False, transient=0):
         # useful parameters
         self.deltaT = deltaT # samping time
         self.n_input = len(x_est0) # input states
@@ -768,25 +2282,161 @@ class KalmanDerivator:
 
         self.I = np.eye(self.n_input)
 
+        # steady-state mode: covariances and gain of the riccati equation
+        self.steady_state = steady_state
+        self.transient = transient
+        self.n_samples = 0
+        if self.steady_state:
+            self.P_hat_ss, self.K_ss, self.P_est_ss = self.solve_steady_state()
+
+    def solve_steady_state(self, tol=1e-13, max_iter=100):
+        """
+        @info solves the discrete algebraic riccati equation of the filter with the 
+              structure-preserving doubling algorithm (each iteration doubles the number 
+              of samples of the covariance recursion).
+        @outputs:
+        -------
+            - P_hat, K, P_est: steady-state covariances and kalman gain
+        """
+        A = tr(self.F)
+        G = mx(tr(self.H), mx(inv(self.Q), self.H))
+        X = copy(self.R)
+        for i in range(max_iter):
+            W = inv(self.I + mx(G, X))
+            AW = mx(A, W)
+            X_next = X + mx(tr(A), mx(X, mx(W, A)))
+            G = G + mx(AW, mx(G, tr(A)))
+            A = mx(AW, A)
+            converged = np.max(np.abs(X_next - X)) <= tol*np.max(np.abs(X_next))
+            X = X_next
+            if converged:
+                break
+        P_hat = X
+        K = mx(mx(P_hat, tr(self.H)), inv(mx(self.H, mx(P_hat, tr(self.H))) + self.Q))
+        P_est = mx(self.I - mx(K,self.H), P_hat)
+        return P_hat, K, P_est
+
+    def covariance_horizon(self, P_hat0, n, tol=1e-12):
+        """
+        @info a priori covariances of n samples of the filter from P_hat0. The riccati recursion
+              P_hat[k+1] = R + F P_hat[k] (I + G P_hat[k])^-1 F^T, with G = H^T Q^-1 H, is a map
+              of the same form as its k-step maps, so the maps of 1, ..., m samples are extended
+              to 2m samples by composing them with the map of m samples (as the doubling of 
+              solve_steady_state). The doubling stops when the covariance converges (relative 
+              change below tol) and the following samples have the steady-state covariance.
+        @outputs:
+        -------
+            - P_hat: a priori covariances [n x 3 x 3]
+        """
+        I = self.I[None]
+        # maps of 1, ..., m samples: P -> X + A^T P (I + G P)^-1 A
+        A = tr(self.F)[None]
+        G = mx(tr(self.H), mx(inv(self.Q), self.H))[None]
+        X = self.R[None]
+        P = np.empty((n, self.n_input, self.n_input))
+        P[0:1] = P_hat0
+        m = 0
+        while m + 1 < n:
+            # values of the maps of m+1, ..., 2m samples
+            k = min(A.shape[0] - m, n - 1 - m)
+            A_k, G_k, X_k = A[m:m+k], G[m:m+k], X[m:m+k]
+            P[m+1:m+1+k] = X_k + mx(tr(A_k, (0, 2, 1)), mx(P_hat0, mx(inv(I + mx(G_k, P_hat0)), A_k)))
+            change = np.max(np.abs(P[m+1:m+1+k] - P[m:m+k]), axis=(1, 2))
+            steady = np.nonzero(change <= tol*np.max(np.abs(P[m+1:m+1+k]), axis=(1, 2)))[0]
+            if steady.shape[0] > 0:
+                # steady-state: the following samples have the same covariance
+                P[m+2+steady[0]:] = P[m+1+steady[0]]
+                break
+            m += k
+            if m + 1 < n:
+                # maps of m+1, ..., 2m samples: the map of m samples followed by the maps of 1, ..., m
+                W = inv(I + mx(G, X[-1]))
+                AW = mx(A[-1], W)
+                A, G, X = (np.concatenate((A, mx(AW, A)), axis=0),
+                           np.concatenate((G, G[-1] + mx(AW, mx(G, tr(A[-1])))), axis=0),
+                           np.concatenate((X, X + mx(tr(A, (0, 2, 1)), mx(X[-1], mx(W, A)))), axis=0))
+        return P
+
     def create_H(self, n_obs, n_input):
         if n_input-n_obs !=0:
             return np.concatenate((np.eye(n_obs), np.zeros((n_obs,n_input-n_obs))), axis=1)
         else:
             return np.eye(n_input)
         
-    def run_kalman_filter(self, q, dq):
-        # measurements
-        self.z = np.array([[q],[dq]])
+    def update_gain(self):
+        """
+        @info propagates the covariance and computes the kalman gain of the next sample.
+              Both of them do not depend on the measurements.
+        """
+        self.n_samples += 1
+        # steady-state mode: fixed gain
+        if self.steady_state and self.n_samples > self.transient:
+            self.P_hat, self.K, self.P_est = self.P_hat_ss, self.K_ss, self.P_est_ss
+            return self.K
         # prediction stage
-        self.x_hat = mx(self.F,self.x_est)
         self.P_hat = mx(self.F, mx(self.P_est, tr(self.F))) +  self.R
-
         # kalman gain
         self.K = mx(mx(self.P_hat, tr(self.H)), inv(mx(self.H, mx(self.P_hat, tr(self.H))) + self.Q))   
+        # observation-correction stage
+        self.P_est = mx(self.I - mx(self.K,self.H), self.P_hat)
+        return self.K
+
+    def smooth(self, q, dq=None, x0=None, tol=1e-12):
+        """
+        @info offline Rauch-Tung-Striebel smoother of a whole recording of several degrees of 
+              freedom with the model of the filter (F, H, Q, R). The covariance recursion is the
+              same for all the degrees of freedom, so it is computed once (covariance_horizon); 
+              the forward (filter) and backward (smoother) passes of the states are vectorized.
+        @inputs:
+        -------
+            - q: measured position [N x n_dof]
+            - dq: measured velocity [N x n_dof] (if n_obs = 2)
+            - x0: initial states [n_dof x 3] (optional, default: q[0], dq[0] and zero acceleration)
+                  with the initial covariance of the filter (P_est)
+            - tol: relative change of the covariance of its steady-state (see covariance_horizon)
+        @outputs:
+        -------
+            - x, dx, ddx: smoothed position, velocity and acceleration [N x n_dof]
+        """
+        q = np.asarray(q, dtype=float)
+        n_dof = 1 if q.ndim == 1 else q.shape[1]
+        q = q.reshape(q.shape[0], n_dof)
+        z = q[:, None, :]
+        if self.n_obs > 1:
+            z = np.stack((q, np.asarray(dq, dtype=float).reshape(q.shape)), axis=1)
+        n = q.shape[0]
+        if x0 is None:
+            x0 = np.zeros((n_dof, self.n_input))
+            x0[:, 0:self.n_obs] = z[0].T
+        x0 = np.asarray(x0, dtype=float).reshape(n_dof, self.n_input).T
+
+        # covariances and kalman gains [N x 3 x n_obs] (shared by all the degrees of freedom)
+        P_hat = self.covariance_horizon(mx(self.F, mx(self.P_est, tr(self.F))) + self.R, n, tol)
+        Ht = tr(self.H)
+        K = mx(mx(P_hat, Ht), inv(mx(self.H, mx(P_hat, Ht)) + self.Q))
+        P_est = mx(self.I - mx(K, self.H), P_hat)
+
+        # forward pass: x_est[k] = (I - K H) F x_est[k-1] + K z[k]
+        IKH = self.I - mx(K, self.H)
+        x_est = affine_scan(mx(IKH, self.F), mx(K, z), x0)
+
+        # backward pass: x_s[k] = C x_s[k+1] + (I - C F) x_est[k], C = P_est[k] F^T P_hat[k+1]^-1
+        C = mx(mx(P_est[:-1], tr(self.F)), inv(P_hat[1:]))
+        x_s = np.empty_like(x_est)
+        x_s[-1] = x_est[-1]
+        if n > 1:
+            x_s[:-1] = affine_scan(C[::-1], mx(self.I - mx(C, self.F), x_est[:-1])[::-1], x_est[-1])[::-1]
+        return x_s[:, 0, :], x_s[:, 1, :], x_s[:, 2, :]
 
+    def run_kalman_filter(self, q, dq):
+        # measurements
+        self.z = np.array([[q],[dq]])
+        # prediction stage
+        self.x_hat = mx(self.F,self.x_est)
+        # kalman gain and covariance
+        self.update_gain()
         # observation-correction stage      
         self.x_est = self.x_hat + mx(self.K, (self.z - mx(self.H, self.x_hat)))
-        self.P_est = mx(self.I - mx(self.K,self.H), self.P_hat)
         
         # return position, velocity and acceleration
         return self.x_est[0][0], self.x_est[1][0], self.x_est[2][0]
@@ -796,15 +2446,28 @@ class DataReader:
     """
     @info: Class to obtain kinematics measurements from external dataset (JIGSAWS)
 
+    @inputs:
+    -------
+        - path: path of the dataset file
+        - dt: sampling time
+        - cache: True to store the processed dataset in a binary file (see load_dataset)
+        - cache_dir: folder of the binary files (optional, default: folder of the dataset)
+
     @methods:
+        - load_dataset(Boolean right_arm)
+        - stream_dataset(Boolean right_arm, chunksize, Boolean blocks)
         - read_dataset(Boolean right_arm)
+        - columns(Boolean right_arm)
+        - extract_pose_velocity(data, Boolean right_arm)
         - calculate()
         - check()
         - dataset_trajectory_generator()
     """ 
-    def __init__(self, path, dt = 0.01):
+    def __init__(self, path, dt = 0.01, cache = False, cache_dir = None):
         
         self.datapath = path
+        self.cache = cache
+        self.cache_dir = cache_dir
         self.xs = np.array([])
         self.dxs = np.array([])
         self.ddxs = np.array([])
@@ -815,15 +2478,129 @@ class DataReader:
         self.i = 0
         self.rpy_old = np.zeros(3)
 
+    def load_dataset(self, right_arm = False):
+        """
+        @info: reads the dataset and computes its derivatives (read_dataset + calculate).
+               With the cache enabled, the processed xs, dxs, ddxs and dddxs are written to a
+               binary file after the first parse and the following loads memory-map it.
+               The rpy unwrapping starts from zero angles (as a new DataReader), and after the
+               load self.rpy_old holds the angles of the last loaded sample, with or without
+               the cache.
+        """
+        self.rpy_old = np.zeros(3)
+        if not self.cache:
+            self.read_dataset(right_arm)
+            self.calculate()
+        else:
+            self.load_cache(right_arm)
+        if self.xs.shape[0] > 0:
+            self.rpy_old = np.array(self.xs[-1,3:6])
+
+    def load_cache(self, right_arm = False):
+        """
+        @info: memory-maps the binary file of the dataset, or parses the dataset and writes it
+        """
+        path = self.cache_path(right_arm)
+        try:
+            data = np.load(path, mmap_mode='c')
+        except (OSError, ValueError):
+            data = None
+        if data is None:
+            self.read_dataset(right_arm)
+            self.calculate()
+            self.write_cache(path, np.stack((self.xs, self.dxs, self.ddxs, self.dddxs)))
+        else:
+            self.df = None
+            self.xs, self.dxs, self.ddxs, self.dddxs = data
+            self.max_count = data.shape[1] + 2
+
+    def cache_path(self, right_arm = False):
+        """
+        @info: path of the binary file of the processed dataset: <file>.<arm>.<key>.<version>.npy.
+               The key depends on the source path and the parameters (dt, right_arm), and the 
+               version on the modification time and size of the source, so a change of any of
+               them invalidates the file.
+        """
+        st = os.stat(self.datapath)
+        source = os.path.abspath(self.datapath)
+        key = repr((source, float(self.dt), bool(right_arm)))
+        version = repr((st.st_mtime_ns, st.st_size))
+        folder = self.cache_dir if self.cache_dir is not None else os.path.dirname(source)
+        name = "{}.{}.{}.{}.npy".format(os.path.basename(source), "right" if right_arm else "left", 
+                                        hashlib.sha1(key.encode()).hexdigest()[:16],
+                                        hashlib.sha1(version.encode()).hexdigest()[:16])
+        return os.path.join(folder, name)
+
+    def write_cache(self, path, data):
+        """
+        @info: writes the binary file and removes the outdated versions of the same key (source
+               path, dt and arm). The dataset is still usable if the folder is not writable.
+        """
+        prefix = path.rsplit('.', 2)[0]
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = path + ".tmp"
+            with open(tmp_path, 'wb') as f:
+                np.save(f, data)
+            os.replace(tmp_path, path)
+            for old_path in glob.glob(glob.escape(prefix) + ".*.npy"):
+                if old_path != path:
+                    os.remove(old_path)
+        except OSError:
+            pass
+
+    def stream_dataset(self, right_arm = False, chunksize = 1000, blocks = False):
+        """
+        @info: reads the dataset in chunks of rows, so the memory is bounded and the first
+               samples are available immediately. It gives the same samples as load_dataset: 
+               the rpy unwrapping and the finite differences continue across the chunks.
+               The unwrapping starts from zero angles (as a new DataReader) and does not use
+               or modify self.rpy_old, so each playback of the file gives the same samples.
+
+        @inputs:
+        -------
+            - right_arm: True to read the right arm
+            - chunksize: number of rows read from the file at once
+            - blocks: True to yield blocks of samples [n x 6] instead of single samples
+        @outputs:
+        --------
+            - x, dx, ddx, dddx: pose, velocity, acceleration and jerk
+        """
+        # last rows of the previous chunk: a sample needs the four following rows
+        tail_x = np.empty((0,6))
+        tail_dx = np.empty((0,6))
+        # rpy angles of the last row (unwrapping state of this playback)
+        rpy_old = np.zeros(3)
+        reader = pd.read_csv(self.datapath, delimiter = r"\s+", header = None, chunksize = chunksize)
+        for chunk in reader:
+            pose, vel = self.extract_pose_velocity(chunk.to_numpy(dtype=float), right_arm, rpy_old)
+            if pose.shape[0] > 0:
+                rpy_old = pose[-1,3:6]
+            xs = np.concatenate((tail_x, pose), axis=0)
+            dxs = np.concatenate((tail_dx, vel), axis=0)
+            n = xs.shape[0] - 4
+            if n <= 0:
+                tail_x, tail_dx = xs, dxs
+                continue
+            ddxs = np.diff(dxs[:n+2], axis = 0) / self.dt
+            dddxs = np.diff(ddxs, axis = 0) / self.dt
+            if blocks:
+                yield xs[:n], dxs[:n], ddxs[:n], dddxs
+            else:
+                for i in range(n):
+                    yield xs[i], dxs[i], ddxs[i], dddxs[i]
+            tail_x, tail_dx = xs[n:], dxs[n:]
+
     def read_dataset(self, right_arm = False):
         self.df = pd.read_csv(self.datapath, delimiter = r"\s+", header = None)
-        df = self.df
-        pose = []
-        vel = []
-        nrows = df.shape[0]
-        self.max_count = nrows- 2
-
+        self.max_count = self.df.shape[0] - 2
+        self.xs, self.dxs = self.extract_pose_velocity(self.df.to_numpy(dtype=float), right_arm)
 
+    def columns(self, right_arm = False):
+        """
+        @info: columns (0-based) of the position, rotation matrix, linear velocity 
+               and angular velocity of an arm in the dataset
+        """
         if right_arm == False:
             # Master
             ix, iy, iz  = 1, 2, 3
@@ -849,32 +2626,39 @@ class DataReader:
             # idx, idy, idz = 70,71,72
             # iwx, iwy, iwz = 73,74, 75
 
-        for i in np.arange(nrows):
-            x = df.iloc[i, ix - 1] # 0.4#- 0.6#- 0.4#+ (right_arm)*(-0.1) + (1 - right_arm)*(0.1) #+0.0#
-            y = df.iloc[i, iy - 1] - 0.5 #+ (right_arm)*(-0.45) + (1 - right_arm)*(0.45) #+0.2#
-            z = df.iloc[i, iz - 1] - 0.1 #+ 0.8 #+0.5#
-
-            R = df.iloc[i, iRs-1:iRe].to_numpy().reshape(3,3)
-            rpy=rot2rpy_unwrapping(R, self.rpy_old)
-            self.rpy_old = copy(rpy)
-
-            roll = rpy[0]
-            pitch = rpy[1]
-            yaw = rpy[2]
-
-            dx = df.iloc[i, idx - 1]
-            dy = df.iloc[i, idy - 1]
-            dz = df.iloc[i, idz - 1]
-
-            wx = df.iloc[i, iwx - 1]
-            wy = df.iloc[i, iwy - 1]
-            wz = df.iloc[i, iwz - 1]
+        return [ix-1, iy-1, iz-1], slice(iRs-1, iRe), [idx-1, idy-1, idz-1], [iwx-1, iwy-1, iwz-1]
 
-            pose.append( [x, y, z, roll, pitch, yaw] )
-            vel.append( [dx, dy, dz, wx, wy, wz])
+    def extract_pose_velocity(self, data, right_arm = False, rpy_old = None):
+        """
+        @info: computes pose (xyz, rpy) and velocity (dxyz, w) of an arm from rows of the dataset.
+               The rpy angles are unwrapped w.r.t. the last sample read (self.rpy_old, which is
+               updated) or w.r.t. rpy_old if it is given.
 
-        self.xs = np.array(pose)
-        self.dxs = np.array(vel)
+        @inputs:
+        -------
+            - data: rows of the dataset [N x n_columns]
+            - right_arm: True to read the right arm
+            - rpy_old: rpy angles of the previous row (optional, default: self.rpy_old)
+        @outputs:
+        --------
+            - pose: [x, y, z, roll, pitch, yaw] [N x 6]
+            - vel: [dx, dy, dz, wx, wy, wz] [N x 6]
+        """
+        i_pos, i_rot, i_vel, i_w = self.columns(right_arm)
+        pose = np.empty((data.shape[0], 6))
+        # xyz position
+        pose[:,0:3] = data[:, i_pos] - np.array([0.0, 0.5, 0.1])
+        # rpy orientation
+        R = data[:, i_rot].reshape(-1,3,3)
+        if rpy_old is not None:
+            pose[:,3:6] = rot2rpy_unwrapping_batch(R, rpy_old)
+        else:
+            pose[:,3:6] = rot2rpy_unwrapping_batch(R, self.rpy_old)
+            if data.shape[0] > 0:
+                self.rpy_old = copy(pose[-1,3:6])
+        # linear and angular velocity
+        vel = np.concatenate((data[:, i_vel], data[:, i_w]), axis=1)
+        return pose, vel
 
     def calculate(self):
         self.ddxs = np.diff(self.dxs, axis = 0) / self.dt
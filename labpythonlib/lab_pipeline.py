@@ -0,0 +1,243 @@
+# ===============================================================
+# 	Info	:	asyncio pipeline of processing stages
+# ===============================================================
+"""
+Connects stages (dataset reader -> IK -> control -> markers) with bounded queues, so a slow
+consumer does not delay the others:
+
+    pipe = Pipeline(dataset_samples(reader), rate=reader.dt)
+    pipe.add_stage('ik', solve_ik, executor='thread')
+    pipe.add_stage('control', control)
+    pipe.add_stage('markers', publish_markers, after='control', maxsize=1, policy='drop_oldest',
+                   executor='thread')
+    asyncio.run(pipe.run())
+    print(pipe.stats())
+"""
+
+# ======================
+#   required libraries
+# ======================
+import time
+import asyncio
+import inspect
+from concurrent.futures import ThreadPoolExecutor
+from labpythonlib.lab_counters import Counter
+
+# end of the stream
+_END = object()
+
+
+# =============
+#   functions
+# =============
+def dataset_samples(reader):
+    """
+    @info: samples (x, dx, ddx, dddx) of a loaded DataReader, as dataset_trajectory_generator
+    """
+    reader.reset()
+    while not reader.check():
+        yield reader.dataset_trajectory_generator()
+
+class Stage(object):
+    """
+    @info: stage of a pipeline: takes items from its queue, processes them and sends the
+           results to the queues of the following stages. The policy of the queue is used
+           when the queue is full:
+           - 'block': the previous stage waits (backpressure, no item is lost)
+           - 'drop_oldest': the oldest item of the queue is discarded (always the last items)
+           - 'drop_newest': the new item is discarded
+
+    @inputs:
+    -------
+        - name: name of the stage
+        - fn: function fn(item) (or coroutine). A None result is not sent to the next stages
+        - maxsize: size of the input queue
+        - policy: 'block', 'drop_oldest' or 'drop_newest'
+        - executor: 'loop' (run in the event loop), 'thread' (thread pool of the pipeline)
+                    or a concurrent.futures executor (e.g. a ProcessPoolExecutor). None: 'thread'
+                    for a function of a stage that drops items (a slow consumer must not block
+                    the event loop), 'loop' otherwise. Coroutines always run in the event loop.
+    """
+    def __init__(self, name, fn, maxsize=8, policy='block', executor=None):
+        if policy not in ('block', 'drop_oldest', 'drop_newest'):
+            raise ValueError("unknown policy: %s" % policy)
+        self.name = name
+        self.fn = fn
+        self.maxsize = maxsize
+        self.policy = policy
+        if executor is None:
+            executor = 'loop' if policy == 'block' or inspect.iscoroutinefunction(fn) else 'thread'
+        self.executor = executor
+        self.outputs = []
+        self.queue = None
+        # statistics
+        self.processed = 0
+        self.dropped = 0
+        self.service = Counter()
+        self.latency = Counter()
+        self.queue_depth = Counter(unit='items')
+
+    async def put(self, item):
+        """
+        @info: puts an item (time of the source, value) in the queue with the policy of the stage
+        """
+        if item is _END:
+            # the end of the stream is never dropped
+            while self.policy != 'block' and self.queue.full():
+                self.queue.get_nowait()
+                self.dropped += 1
+            await self.queue.put(item)
+        elif self.policy == 'block':
+            await self.queue.put(item)
+        elif not self.queue.full():
+            self.queue.put_nowait(item)
+        elif self.policy == 'drop_oldest':
+            self.queue.get_nowait()
+            self.queue.put_nowait(item)
+            self.dropped += 1
+        else:
+            self.dropped += 1
+
+    async def send(self, item):
+        for stage in self.outputs:
+            await stage.put(item)
+
+    def summary(self):
+        return {'processed': self.processed, 'dropped': self.dropped, 'policy': self.policy,
+                'maxsize': self.maxsize, 'service': self.service.summary(),
+                'latency': self.latency.summary(), 'queue_depth': self.queue_depth.summary()}
+
+class Pipeline(object):
+    """
+    @info: asyncio pipeline: a source and stages connected by bounded queues. Each stage runs
+           as a task, and the heavy stages can run in an executor, so the event loop is free
+           for the other stages. It measures the service time and the latency (time since the
+           item left the source) of each stage and the depth of the queues.
+
+    @inputs:
+    -------
+        - source: iterable (or async iterable) of items
+        - rate: period between the items of the source [sec] (optional, None: as fast as possible)
+        - n_threads: threads of the pipeline executor (stages with executor='thread')
+
+    @methods:
+        - add_stage(name, fn, after, maxsize, policy, executor)
+        - run()
+        - stats()
+    """
+    def __init__(self, source, rate=None, n_threads=4):
+        self.source = source
+        self.rate = rate
+        self.n_threads = n_threads
+        self.stages = dict()
+        self.first = []
+        self.last = None
+        self.source_items = 0
+        self.source_late = 0
+
+    def add_stage(self, name, fn, after=None, maxsize=8, policy='block', executor=None):
+        """
+        @info: adds a stage after the stage "after" (optional, default: the last added stage).
+               after='source' connects the stage to the source.
+        """
+        if name in self.stages or name == 'source':
+            raise ValueError("repeated stage: %s" % name)
+        stage = Stage(name, fn, maxsize, policy, executor)
+        if after is None:
+            after = self.last if self.last is not None else 'source'
+        if after == 'source':
+            self.first.append(stage)
+        else:
+            self.stages[after].outputs.append(stage)
+        self.stages[name] = stage
+        self.last = name
+        return stage
+
+    async def _run_source(self):
+        clock = time.perf_counter
+        t_next = None
+        if hasattr(self.source, '__aiter__'):
+            items = self.source.__aiter__()
+            get_next = items.__anext__
+        else:
+            items = iter(self.source)
+
+            async def get_next():
+                try:
+                    return next(items)
+                except StopIteration:
+                    raise StopAsyncIteration
+        while True:
+            if self.rate is not None:
+                if t_next is None:
+                    # the first item sets the deadlines of the next ones
+                    t_next = clock()
+                else:
+                    delay = t_next - clock()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                    else:
+                        self.source_late += 1
+                t_next += self.rate
+            try:
+                value = await get_next()
+            except StopAsyncIteration:
+                break
+            self.source_items += 1
+            for stage in self.first:
+                await stage.put((clock(), value))
+        for stage in self.first:
+            await stage.put(_END)
+
+    async def _run_stage(self, stage, executor):
+        clock = time.perf_counter
+        loop = asyncio.get_running_loop()
+        coroutine = inspect.iscoroutinefunction(stage.fn)
+        while True:
+            stage.queue_depth.add(stage.queue.qsize())
+            item = await stage.queue.get()
+            if item is _END:
+                break
+            t_source, value = item
+            t0 = clock()
+            if coroutine:
+                result = await stage.fn(value)
+            elif stage.executor == 'loop':
+                result = stage.fn(value)
+            else:
+                result = await loop.run_in_executor(executor if stage.executor == 'thread'
+                                                    else stage.executor, stage.fn, value)
+            t1 = clock()
+            stage.service.add(t1 - t0)
+            stage.latency.add(t1 - t_source)
+            stage.processed += 1
+            if result is not None:
+                await stage.send((t_source, result))
+        await stage.send(_END)
+
+    async def run(self):
+        """
+        @info: runs the pipeline until the source ends and all the stages are done.
+               An error in a stage cancels the other stages and is raised.
+        """
+        for stage in self.stages.values():
+            stage.queue = asyncio.Queue(stage.maxsize)
+        executor = ThreadPoolExecutor(self.n_threads)
+        tasks = [asyncio.ensure_future(self._run_source())]
+        tasks += [asyncio.ensure_future(self._run_stage(stage, executor)) for stage in self.stages.values()]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            executor.shutdown(wait=False)
+
+    def stats(self):
+        """
+        @info: items and late items of the source, and statistics of each stage:
+               processed and dropped items, service time, latency and queue depth
+        """
+        stats = {'source': {'items': self.source_items, 'late': self.source_late}}
+        for name, stage in self.stages.items():
+            stats[name] = stage.summary()
+        return stats
@@ -0,0 +1,213 @@
+# ===============================================================
+# 	Info	:	opt-in timing counters of the library hot paths
+# ===============================================================
+"""
+Counts and times the pinocchio calls and the public methods of Robot, KinematicsCache, IKSolver,
+DampedLeastSquares, KalmanDerivator, MultipleKalmanDerivator and DataReader:
+
+    from labpythonlib import lab_profiler
+    lab_profiler.enable(dump_period=10.0, dump_path='profile.json')
+    ...
+    print(lab_profiler.stats()['pin.crba'])
+    lab_profiler.dump()
+    lab_profiler.disable()
+
+The methods are wrapped only while the profiler is enabled, so it has no overhead when it
+is disabled.
+"""
+
+# ======================
+#   required libraries
+# ======================
+import os
+import json
+import time
+import types
+import inspect
+import threading
+import labpythonlib.lab_functions as lf
+from labpythonlib.lab_counters import Counter
+
+
+# ============
+#   counters
+# ============
+# counters by name ('pin.crba', 'Robot.send_control_command', ...)
+_counters = dict()
+# replaced attributes: (owner, name, original value)
+_patches = []
+# periodic dump
+_dump_thread = None
+_dump_stop = threading.Event()
+
+# classes whose public methods are timed
+CLASSES = ('Robot', 'KinematicsCache', 'IKSolver', 'DampedLeastSquares', 'KalmanDerivator', 
+           'MultipleKalmanDerivator', 'DataReader')
+# module functions that are timed
+FUNCTIONS = ('forward_dynamics', 'damped_pinv', 'damped_least_squares')
+
+
+# =============
+#   functions
+# =============
+def record(name, value, unit='s'):
+    """
+    @info: adds a sample (duration in seconds by default) to the counter "name"
+    """
+    counter = _counters.get(name)
+    if counter is None:
+        counter = _counters.setdefault(name, Counter(unit))
+    counter.add(value)
+
+class timed(object):
+    """
+    @info: context manager that records the duration of a block: with timed('stage'): ...
+    """
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.name, time.perf_counter() - self.t0)
+        return False
+
+def _timed_function(name, fn):
+    clock = time.perf_counter
+
+    def wrapper(*args, **kwargs):
+        t0 = clock()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            record(name, clock() - t0)
+    wrapper.__name__ = getattr(fn, '__name__', name)
+    wrapper.__doc__ = getattr(fn, '__doc__', None)
+    wrapper.__wrapped__ = fn
+    return wrapper
+
+def _timed_ik_solve(fn):
+    timed_solve = _timed_function('IKSolver.solve', fn)
+
+    def solve(self, *args, **kwargs):
+        q = timed_solve(self, *args, **kwargs)
+        record('IKSolver.solve:iterations', self.iterations, unit='iterations')
+        return q
+    solve.__doc__ = fn.__doc__
+    solve.__wrapped__ = fn
+    return solve
+
+class _TimedModule(object):
+    """
+    @info: proxy of the pinocchio module: its functions are timed as 'pin.<name>'
+    """
+    def __init__(self, module, prefix='pin'):
+        self._module = module
+        self._prefix = prefix
+        self._cache = dict()
+
+    def __getattr__(self, name):
+        value = self._cache.get(name)
+        if value is None:
+            value = getattr(self._module, name)
+            if isinstance(value, types.ModuleType):
+                value = _TimedModule(value, self._prefix + '.' + name)
+            elif callable(value) and not inspect.isclass(value):
+                value = _timed_function(self._prefix + '.' + name, value)
+            self._cache[name] = value
+        return value
+
+def _patch(owner, name, value):
+    _patches.append((owner, name, owner.__dict__[name] if isinstance(owner, type) else getattr(owner, name)))
+    setattr(owner, name, value)
+
+def enabled():
+    return len(_patches) > 0
+
+def enable(pinocchio=True, methods=True, dump_period=None, dump_path=None):
+    """
+    @info: starts timing the library calls
+
+    @inputs:
+    -------
+        - pinocchio: True to time each pinocchio call made by the library
+        - methods: True to time the public methods of the classes in CLASSES and the FUNCTIONS
+        - dump_period: period of the dump of the statistics [sec] (optional, None: no dump)
+        - dump_path: json file of the periodic dump (optional, None: printed table)
+    """
+    global _dump_thread
+    if enabled():
+        disable()
+    if pinocchio:
+        _patch(lf, 'pin', _TimedModule(lf.pin))
+    if methods:
+        for name in FUNCTIONS:
+            _patch(lf, name, _timed_function(name, getattr(lf, name)))
+        for class_name in CLASSES:
+            cls = getattr(lf, class_name)
+            for name, value in list(cls.__dict__.items()):
+                if name.startswith('_'):
+                    continue
+                if isinstance(value, property):
+                    _patch(cls, name, property(_timed_function(class_name + '.' + name, value.fget)))
+                elif inspect.isfunction(value) and not inspect.isgeneratorfunction(value):
+                    if class_name == 'IKSolver' and name == 'solve':
+                        _patch(cls, name, _timed_ik_solve(value))
+                    else:
+                        _patch(cls, name, _timed_function(class_name + '.' + name, value))
+    if dump_period is not None:
+        _dump_stop.clear()
+        _dump_thread = threading.Thread(target=_periodic_dump, args=(dump_period, dump_path), daemon=True)
+        _dump_thread.start()
+
+def disable():
+    """
+    @info: stops timing (the statistics are kept until reset)
+    """
+    global _dump_thread
+    while _patches:
+        owner, name, value = _patches.pop()
+        setattr(owner, name, value)
+    if _dump_thread is not None:
+        _dump_stop.set()
+        _dump_thread.join()
+        _dump_thread = None
+
+def stats():
+    """
+    @info: snapshot of the counters: {name: {unit, calls, total, mean, p50, p90, p99, max}}
+    """
+    return {name: counter.summary() for name, counter in list(_counters.items())}
+
+def reset():
+    """
+    @info: removes all the counters
+    """
+    _counters.clear()
+
+def dump(path=None):
+    """
+    @info: writes the statistics to a json file or prints them as a table (path=None)
+    """
+    snapshot = stats()
+    if path is not None:
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'time': time.time(), 'stats': snapshot}, f, indent=2)
+        os.replace(tmp_path, path)
+        return
+    print("{:<48s} {:>9s} {:>11s} {:>10s} {:>10s} {:>10s}".format(
+          'name', 'calls', 'total [ms]', 'p50 [us]', 'p99 [us]', 'max [us]'))
+    for name, s in sorted(snapshot.items(), key=lambda item: -item[1]['total']):
+        if s['unit'] == 's':
+            print("{:<48s} {:>9d} {:>11.3f} {:>10.2f} {:>10.2f} {:>10.2f}".format(
+                  name, s['calls'], 1e3*s['total'], 1e6*s['p50'], 1e6*s['p99'], 1e6*s['max']))
+        else:
+            print("{:<48s} {:>9d} {:>11s} {:>10.2f} {:>10.2f} {:>10.2f}  [{}]".format(
+                  name, s['calls'], '-', s['p50'], s['p99'], s['max'], s['unit']))
+
+def _periodic_dump(period, path):
+    while not _dump_stop.wait(period):
+        dump(path)
@@ -0,0 +1,179 @@
+# ===============================================================
+# 	Info	:	fixed-rate loop with deadline and jitter statistics
+# ===============================================================
+"""
+Runs a control loop at 1/dt with a monotonic clock (time.perf_counter):
+
+    loop = RateLoop(robot.dt, policy='skip')
+    def step(t):
+        with loop.stage('reference'):
+            x_des, dx_des, ddx_des = reference(t)
+        with loop.stage('control'):
+            robot.send_control_command(controller(x_des, dx_des, ddx_des))
+    loop.run(step, duration=10.0)
+    print(loop.stats())
+
+or, as rospy.Rate, with a loop of the script: while ...: step(); loop.sleep()
+"""
+
+# ======================
+#   required libraries
+# ======================
+import time
+import numpy as np
+from labpythonlib.lab_counters import Counter
+
+
+class RateLoop(object):
+    """
+    @info: calls a step function every dt seconds. It sleeps until shortly before each deadline
+           and spins the last part of the wait, so the wake-up jitter does not depend on the
+           resolution of time.sleep. A tick that starts after its deadline is a missed deadline:
+           - policy 'catch_up': the missed ticks are run as soon as possible (no tick is lost)
+           - policy 'skip': the missed ticks are skipped, the loop restarts at the next deadline
+
+    @inputs:
+    -------
+        - dt: period of the loop [sec]
+        - policy: 'catch_up' or 'skip'
+        - spin: last part of the wait done by spinning [sec]
+        - jitter_edges: edges of the jitter histogram [sec] (optional)
+
+    @methods:
+        - run(step, duration, n_ticks)
+        - sleep()
+        - stage(name)
+        - stop()
+        - stats()
+        - reset_stats()
+    """
+    def __init__(self, dt, policy='skip', spin=0.0002, jitter_edges=None):
+        if policy not in ('catch_up', 'skip'):
+            raise ValueError("unknown policy: %s" % policy)
+        self.dt = dt
+        self.policy = policy
+        self.spin = spin
+        self.clock = time.perf_counter
+        if jitter_edges is None:
+            jitter_edges = 1e-6*np.array([1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000])
+        self.jitter_edges = np.asarray(jitter_edges, dtype=float)
+        self.running = False
+        # deadlines: t_start + tick*dt
+        self.t_start = None
+        self.tick = 0
+        self.t_wake = None
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.ticks = 0
+        self.missed = 0
+        self.skipped = 0
+        self.jitter = Counter()
+        self.jitter_histogram = np.zeros(self.jitter_edges.shape[0] + 1, dtype=int)
+        self.step_time = Counter()
+        self.stages = dict()
+
+    def start(self):
+        """
+        @info: sets the first deadline at the current time
+        """
+        self.t_start = self.clock()
+        self.tick = 0
+        self.t_wake = self.t_start
+
+    @property
+    def t(self):
+        """
+        @info: scheduled time of the current tick w.r.t. the start [sec]
+        """
+        return self.tick*self.dt
+
+    def sleep(self):
+        """
+        @info: waits until the deadline of the next tick (call it at the end of each tick)
+        """
+        if self.t_start is None:
+            self.start()
+        now = self.clock()
+        self.step_time.add(now - self.t_wake)
+        self.ticks += 1
+        self.tick += 1
+        deadline = self.t_start + self.tick*self.dt
+        if now > deadline:
+            # missed deadline
+            self.missed += 1
+            if self.policy == 'skip':
+                late = int((now - deadline)/self.dt) + 1
+                self.skipped += late
+                self.tick += late
+                deadline = self.t_start + self.tick*self.dt
+        # sleep, then spin until the deadline
+        remaining = deadline - self.spin - now
+        if remaining > 0:
+            time.sleep(remaining)
+        now = self.clock()
+        while now < deadline:
+            now = self.clock()
+        self.t_wake = now
+        # wake-up jitter
+        jitter = now - deadline
+        self.jitter.add(jitter)
+        self.jitter_histogram[np.searchsorted(self.jitter_edges, jitter, side='right')] += 1
+
+    def stage(self, name):
+        """
+        @info: context manager that measures the duration of a stage of the tick
+        """
+        counter = self.stages.get(name)
+        if counter is None:
+            counter = self.stages[name] = Counter()
+        return _Stage(counter, self.clock)
+
+    def stop(self):
+        self.running = False
+
+    def run(self, step, duration=None, n_ticks=None):
+        """
+        @info: calls step(t) every dt seconds, where t is the scheduled time of the tick [sec]
+        @inputs:
+        -------
+            - step: function step(t) of a tick. It stops the loop if it returns False
+            - duration: duration of the loop [sec] (optional)
+            - n_ticks: number of ticks (optional). Without duration and n_ticks the loop
+                       runs until stop() is called
+        """
+        if duration is not None:
+            n_end = int(round(duration/self.dt))
+            n_ticks = n_end if n_ticks is None else min(n_ticks, n_end)
+        self.running = True
+        self.start()
+        while self.running and (n_ticks is None or self.tick < n_ticks):
+            if step(self.t) is False:
+                break
+            self.sleep()
+        self.running = False
+
+    def stats(self):
+        """
+        @info: ticks, missed deadlines, skipped ticks, jitter (summary and histogram),
+               duration of the ticks and of the stages
+        """
+        return {'dt': self.dt, 'policy': self.policy, 'ticks': self.ticks, 'missed': self.missed,
+                'skipped': self.skipped, 'jitter': self.jitter.summary(),
+                'jitter_histogram': {'edges': self.jitter_edges.tolist(),
+                                     'counts': self.jitter_histogram.tolist()},
+                'step': self.step_time.summary(),
+                'stages': {name: counter.summary() for name, counter in self.stages.items()}}
+
+class _Stage(object):
+    def __init__(self, counter, clock):
+        self.counter = counter
+        self.clock = clock
+
+    def __enter__(self):
+        self.t0 = self.clock()
+        return self
+
+    def __exit__(self, *exc):
+        self.counter.add(self.clock() - self.t0)
+        return False
@@ -0,0 +1,43 @@
+# ===============================================================
+# 	Info	:	closed-loop tests of DifferentialIKTracker
+# ===============================================================
+import os
+import numpy as np
+import labpythonlib.lab_functions as lf
+
+URDF_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks', 'bench_arm.urdf')
+Q_HOME = np.array([0.0, -0.8, 1.2, -0.4, 0.5, 0.3])
+
+
+def make_target(robot, offset=0.05):
+    p, R = robot.forward_kinematics(Q_HOME)
+    return p + np.array([offset, 0.0, 0.0]), R
+
+def test_robot_held_still_does_not_wind_up():
+    # the robot does not move: each tick must give the same solution
+    robot = lf.Robot(Q_HOME.copy(), np.zeros(6), 0.001, URDF_PATH)
+    x_des, R_des = make_target(robot)
+    tracker = lf.DifferentialIKTracker(robot)
+    q_first, _ = tracker.update(x_des, R_des)
+    q_first = q_first.copy()
+    for _ in range(20):
+        q, _ = tracker.update(x_des, R_des)
+    assert np.allclose(q, q_first, atol=1e-12)
+    p, _ = robot.forward_kinematics(q)
+    assert np.linalg.norm(p - x_des) < 5e-3
+
+def test_lagging_robot_converges():
+    # M*PD + b loop without velocity feed-forward: the robot lags the solution of the tracker
+    robot = lf.Robot(Q_HOME.copy(), np.zeros(6), 0.001, URDF_PATH)
+    x_des, R_des = make_target(robot)
+    tracker = lf.DifferentialIKTracker(robot)
+    kp, kd = 400.0, 40.0
+    for _ in range(2000):
+        q_des, _ = tracker.update(x_des, R_des)
+        u = robot.M.dot(kp*(q_des - robot.q) - kd*robot.dq) + robot.b
+        robot.send_control_command(u)
+    p, R = robot.forward_kinematics(tracker.q)
+    assert np.linalg.norm(p - x_des) < 1e-4
+    assert np.linalg.norm(lf.axisangle_error(R_des, R)) < 1e-3
+    assert np.linalg.norm(robot.p - x_des) < 1e-3
+    assert np.all(np.abs(tracker.q) < 3.0)